@@ -0,0 +1,182 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import localization
+import util.args_util as args_util
+import wackypywebm
+from util.scheduler import SegmentScheduler
+
+VIDEO_EXTENSIONS = {'.mp4', '.webm', '.mkv', '.mov', '.avi', '.gif', '.m4v', '.flv', '.wmv'}
+
+
+class BatchJob:
+    __slots__ = ('file', 'modes', 'options', 'output')
+
+    def __init__(self, file: Path, modes: str, options: List[str], output: Optional[Path] = None) -> None:
+        self.file = file
+        self.modes = modes
+        self.options = options  # command line flags, the same ones wackypywebm.py takes
+        self.output = output
+
+
+class JobResult:
+    __slots__ = ('job', 'frames', 'elapsed', 'error')
+
+    def __init__(self, job: BatchJob, frames: int, elapsed: float, error: Optional[BaseException] = None) -> None:
+        self.job = job
+        self.frames = frames
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+
+def options_to_flags(options: Union[List[Any], Dict[str, Any]]) -> List[str]:
+    """Turns manifest options, either a list of flags or a dict like {"tempo": 3, "cache": true}, into flags."""
+    if isinstance(options, list):
+        return [str(option) for option in options]
+    flags = []
+    for key, value in options.items():
+        flag = f'--{key.replace("_", "-")}'
+        if value is True:
+            flags.append(flag)
+        elif value not in (False, None):
+            flags += [flag, str(value)]
+    return flags
+
+
+def read_manifest(manifest_path: Path, default_modes: str) -> List[BatchJob]:
+    """Reads a JSON list of {"file", "modes", "options", "output"} jobs. Relative paths start at the manifest."""
+    jobs = []
+    for entry in json.loads(manifest_path.read_text(encoding='utf-8')):
+        output = entry.get('output')
+        jobs.append(
+            BatchJob(
+                (manifest_path.parent / entry['file']).resolve(),
+                entry.get('modes', default_modes),
+                options_to_flags(entry.get('options', [])),
+                (manifest_path.parent / output).resolve() if output else None,
+            )
+        )
+    return jobs
+
+
+def collect_jobs(inputs: List[str], default_modes: str) -> List[BatchJob]:
+    jobs: List[BatchJob] = []
+    for batch_input in inputs:
+        path = Path(batch_input)
+        if path.suffix.lower() == '.json' and path.is_file():
+            jobs += read_manifest(path, default_modes)
+        elif path.is_dir():
+            jobs += [
+                BatchJob(file.resolve(), default_modes, [])
+                for file in sorted(path.iterdir())
+                if file.is_file() and file.suffix.lower() in VIDEO_EXTENSIONS
+            ]
+        else:
+            jobs += [BatchJob(Path(file).resolve(), default_modes, []) for file in sorted(glob.glob(batch_input))]
+    return jobs
+
+
+def parse_job(
+    job: BatchJob, common_flags: List[str], output_dir: Optional[Path] = None
+) -> Tuple[args_util.IArgs, List[str], Path]:
+    """Returns the arguments, selected modes and output path of `job`, raising ValueError if it is invalid."""
+    try:
+        # per job options come last so they win over the common ones
+        args = args_util.parse_args([str(job.file), job.modes, *common_flags, *job.options])
+    except SystemExit as error:
+        raise ValueError(f'Invalid options for {job.file}: {" ".join(job.options)}') from error
+    if not job.file.is_file():
+        raise ValueError(f'Video file "{job.file}" not found.')
+    selected_modes = [mode.lower() for mode in args.modes.split('+')]
+    for selected_mode in selected_modes:
+        if selected_mode not in wackypywebm.MODES:
+            raise ValueError(f'Mode "{selected_mode}" isn\'t available.')
+
+    output_path = job.output or args.output
+    if output_path is None:
+        output_path = wackypywebm.get_default_output_path(job.file, selected_modes)
+        if output_dir:
+            output_path = output_dir / output_path.name
+    return args, selected_modes, output_path.resolve()
+
+
+def run_job(job: BatchJob, common_flags: List[str], output_dir: Optional[Path], scheduler: SegmentScheduler):
+    start_time = time.perf_counter()
+    try:
+        args, selected_modes, output_path = parse_job(job, common_flags, output_dir)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        plan = wackypywebm.wackify(selected_modes, job.file, args, output_path, [], scheduler)
+    except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+        return JobResult(job, 0, time.perf_counter() - start_time, error)
+    return JobResult(job, plan.num_frames, time.perf_counter() - start_time)
+
+
+PARSER = argparse.ArgumentParser(
+    description='Renders many videos through one shared pool of encoder threads. '
+    'Any other option is passed on to every job, see wackypywebm.py --help.'
+)
+PARSER.add_argument('inputs', nargs='+', help='Folders, glob patterns or JSON manifests of videos to make wacky.')
+PARSER.add_argument('-m', '--modes', type=str, default='bounce', help='Modes to apply to jobs that do not set any.')
+PARSER.add_argument('--output-dir', type=Path, help='Puts outputs in this folder instead of next to their videos.')
+PARSER.add_argument(
+    '-j', '--jobs', type=int, default=4, help='Sets how many videos are probed, split and concatenated at once.'
+)
+PARSER.add_argument(
+    '--threads',
+    type=int,
+    default=os.cpu_count(),
+    help='Sets maximum number of encoder threads, shared by all jobs.',
+)
+PARSER.add_argument(
+    '-l', '--language', type=str, default='en_us', choices=localization.get_locales(), help='Sets language.'
+)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    batch_args, common_flags = PARSER.parse_known_args(argv)
+    localization.set_locale(batch_args.language)
+    common_flags += ['--threads', str(batch_args.threads)]
+    output_dir: Optional[Path] = batch_args.output_dir.resolve() if batch_args.output_dir else None
+
+    jobs = collect_jobs(batch_args.inputs, batch_args.modes)
+    if not jobs:
+        print('No videos found.')
+        return 1
+
+    scheduler = SegmentScheduler(batch_args.threads)
+    results: List[JobResult] = []
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max(1, batch_args.jobs)) as executor:
+        futures = [executor.submit(run_job, job, common_flags, output_dir, scheduler) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = f'failed: {result.error}' if result.error else f'{result.frames} frames, {result.fps:.1f} fps'
+            print(f'[{len(results)}/{len(jobs)}] {result.job.file.name} ({result.elapsed:.2f}s) {status}')
+    elapsed = time.perf_counter() - start_time
+
+    failed = [result for result in results if result.error]
+    total_frames = sum(result.frames for result in results)
+    print('-' * 20)
+    print(
+        f'{len(results) - len(failed)}/{len(results)} jobs done in {elapsed:.2f}s, '
+        f'{total_frames} frames, {total_frames / elapsed if elapsed else 0.0:.1f} fps overall'
+    )
+    for result in failed:
+        print(f'Failed: {result.job.file}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
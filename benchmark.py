@@ -0,0 +1,214 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import localization
+import modes.keyframes as keyframes
+import util.args_util as args_util
+import util.ffmpeg_util as ffmpeg_util
+import util.trace as trace
+import wackypywebm
+from util.audio_levels import AudioLevels
+
+# the trace spans wackify records; the ones before planning run side by side, so they add up to more than the total
+PHASES = ['probe', 'min_size', 'audio_split', 'audio_analysis', 'frame_split', 'planning', 'encode', 'concat']
+# (width, height, fps, seconds)
+PRESETS: Dict[str, List[Tuple[int, int, int, int]]] = {
+    'quick': [(320, 240, 30, 2)],
+    'full': [
+        (320, 240, 30, 2),
+        (640, 360, 30, 5),
+        (1280, 720, 30, 5),
+        (640, 360, 60, 5),
+        (1280, 720, 24, 10),
+    ],
+}
+COMBINATIONS = ['bounce+shutter', 'shutter+audiobounce', 'rotate+bounce', 'sporadic+audioshutter']
+KEYFRAMES = '0, 320, 240\n1, 160, 60\n2, 320, 240, instant\n'
+SEED = 0
+
+
+def generate_input(folder: Path, width: int, height: int, fps: int, seconds: int) -> Path:
+    """Writes a lossless test video with a beeping tone, so audio modes see changing levels."""
+    video_path = folder / f'testsrc_{width}x{height}_{fps}fps_{seconds}s.mkv'
+    if not video_path.exists():
+        # fmt:off
+        subprocess.run(
+            [
+                'ffmpeg', '-v', 'error', '-y',
+                '-f', 'lavfi', '-i', f'testsrc=size={width}x{height}:rate={fps}:duration={seconds}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:beep_factor=4:duration={seconds}',
+                '-c:v', 'ffv1', '-c:a', 'flac', video_path,
+            ],
+            check=True,
+        )
+        # fmt:on
+    return video_path
+
+
+def clear_caches():
+    """Forgets what earlier renders in this process worked out, so every run pays for it again."""
+    ffmpeg_util.find_min_non_error_size.cache_clear()
+    AudioLevels.levels.clear()
+    keyframes.Mode.parsed.clear()
+    keyframes.compile_expression.cache_clear()
+
+
+def run_pipeline(
+    video_path: Path, modes: str, flags: List[str], output_folder: Path
+) -> Tuple[Dict[str, float], float, int, int]:
+    """Renders through wackify with cold caches, timing every phase by its trace span.
+
+    Returns the phase timings, the total time, the frame count and the segment count.
+    """
+    selected_modes = modes.split('+')
+    output_path = output_folder / wackypywebm.get_default_output_path(video_path, selected_modes).name
+    # a private cache per run, so results depend neither on earlier runs nor on what other renders left behind
+    with tempfile.TemporaryDirectory(prefix='cache_', dir=output_folder) as cache_dir:
+        args = args_util.parse_args([str(video_path), modes, '--cache-dir', cache_dir, *flags])
+        clear_caches()
+        random.seed(SEED)
+        np.random.seed(SEED)
+
+        trace.start()
+        start_time = time.perf_counter()
+        try:
+            plan = wackypywebm.wackify(selected_modes, video_path, args, output_path, progress_subscribers=[])
+        finally:
+            total = time.perf_counter() - start_time
+            events = trace.stop()
+
+    timings = {phase: 0.0 for phase in PHASES}
+    for event in events:
+        if event['cat'] == 'phase' and event['name'] in timings:
+            timings[event['name']] += event['dur'] / 1_000_000
+    return timings, total, plan.num_frames, len(plan.segments)
+
+
+def run_benchmarks(preset: str, modes: List[str], repeat: int, flags: List[str], verbose: bool) -> List[Dict[str, Any]]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix='wackybench_') as folder:
+        folder_path = Path(folder)
+        keyframe_file = folder_path / 'keyframes.txt'
+        keyframe_file.write_text(KEYFRAMES, encoding='utf-8')
+
+        for width, height, fps, seconds in PRESETS[preset]:
+            video_path = generate_input(folder_path, width, height, fps, seconds)
+            for mode in modes:
+                mode_flags = flags + (['--keyframes', str(keyframe_file)] if 'keyframes' in mode else [])
+                runs = []
+                for _ in range(repeat):
+                    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                        runs.append(run_pipeline(video_path, mode, mode_flags, folder_path))
+
+                phases = {phase: statistics.median(run[0][phase] for run in runs) for phase in PHASES}
+                total = statistics.median(run[1] for run in runs)
+                _, _, frames, segments = runs[0]
+                results.append(
+                    {
+                        'input': video_path.stem,
+                        'width': width,
+                        'height': height,
+                        'fps': fps,
+                        'seconds': seconds,
+                        'modes': mode,
+                        'frames': frames,
+                        'segments': segments,
+                        'phases': phases,
+                        'total': total,
+                        'frames_per_second': frames / total if total else 0.0,
+                    }
+                )
+                print(f'{video_path.stem:<32} {mode:<24} {total:>8.2f}s {frames / total if total else 0.0:>8.1f} fps')
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Lists every phase and total that got slower than the baseline by more than `tolerance`."""
+    regressions = []
+    baseline_results = {(result['input'], result['modes']): result for result in baseline}
+    for result in results:
+        base = baseline_results.get((result['input'], result['modes']))
+        if base is None:
+            continue
+        timings = [('total', result['total'], base['total'])]
+        timings += [(phase, result['phases'][phase], base['phases'].get(phase, 0.0)) for phase in PHASES]
+        for name, current, previous in timings:
+            # ignore phases too short to time reliably
+            if previous > 0.05 and current > previous * (1 + tolerance):
+                regressions.append(
+                    f'{result["input"]} {result["modes"]} {name}: {previous:.3f}s -> {current:.3f}s '
+                    f'(+{100 * (current / previous - 1):.0f}%)'
+                )
+    return regressions
+
+
+def get_ffmpeg_version() -> str:
+    return subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True).stdout.decode().splitlines()[0]
+
+
+PARSER = argparse.ArgumentParser(
+    description='Times every phase of a render for each mode on generated test videos. '
+    'Any other option is passed on to every render, see wackypywebm.py --help.'
+)
+PARSER.add_argument('--preset', type=str, choices=list(PRESETS), default='quick', help='Sets which videos to test.')
+PARSER.add_argument(
+    '--modes', type=str, nargs='*', help='Modes to test. Defaults to every mode and a few combinations.'
+)
+PARSER.add_argument('--repeat', type=int, default=3, help='Runs every benchmark this often and keeps the median.')
+PARSER.add_argument('-o', '--output', type=Path, default=Path('benchmark.json'), help='Sets where results go.')
+PARSER.add_argument('--baseline', type=Path, help='Results of an earlier run to compare against.')
+PARSER.add_argument(
+    '--tolerance', type=float, default=0.1, help='Sets how much slower than the baseline counts as a regression.'
+)
+PARSER.add_argument('-v', '--verbose', action='store_true', help='Shows the output of every render.')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    bench_args, flags = PARSER.parse_known_args(argv)
+    localization.set_locale('en_us')
+    modes = bench_args.modes or sorted(wackypywebm.MODES) + COMBINATIONS
+
+    results = run_benchmarks(bench_args.preset, modes, max(1, bench_args.repeat), flags, bench_args.verbose)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': get_ffmpeg_version(),
+            'preset': bench_args.preset,
+            'repeat': bench_args.repeat,
+            'flags': flags,
+        },
+        'results': results,
+    }
+    bench_args.output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print('Results written to', bench_args.output)
+
+    if bench_args.baseline:
+        baseline = json.loads(bench_args.baseline.read_text(encoding='utf-8'))
+        regressions = compare(results, baseline['results'], bench_args.tolerance)
+        for regression in regressions:
+            print('Slower:', regression)
+        if regressions:
+            return 1
+        print('No regressions against', bench_args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
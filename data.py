@@ -3,7 +3,7 @@ from typing import Optional
 
 
 class SetupData:
-    __slots__ = ('video_path', 'width', 'height', 'num_frames', 'fps', 'keyframe_file')
+    __slots__ = ('video_path', 'width', 'height', 'num_frames', 'fps', 'keyframe_file', 'cache_dir')
 
     def __init__(
         self,
@@ -13,6 +13,7 @@ class SetupData:
         num_frames: int,
         fps: float,
         keyframe_file: Optional[Path] = None,
+        cache_dir: Optional[Path] = None,
     ) -> None:
         self.video_path = video_path
         self.width = width
@@ -20,6 +21,7 @@ class SetupData:
         self.num_frames = num_frames
         self.fps = fps
         self.keyframe_file = keyframe_file
+        self.cache_dir = cache_dir
 
 
 class BaseData:
@@ -40,7 +42,7 @@ class BaseData:
 class Data(BaseData):
     __slots__ = ('frame_index', 'frame_path')
 
-    def __init__(self, base_data: BaseData, frame_index: int, frame_path: Path) -> None:
+    def __init__(self, base_data: BaseData, frame_index: int, frame_path: Optional[Path]) -> None:
         super().__init__(
             base_data.width,
             base_data.height,
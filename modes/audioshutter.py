@@ -1,24 +1,26 @@
 import math
-from typing import List
 
-import util.ffmpeg_util as ffmpeg_util
-from data import Data, SetupData
-from modes.mode_base import FrameAudioLevel, FrameBounds, ModeBase
+import numpy as np
+
+from data import BaseData, Data, SetupData
+from modes.mode_base import FrameBounds, FrameBoundsBatch, ModeBase
+from util.audio_levels import AudioLevels
 
 
 class Mode(ModeBase):
-    frames_audio_levels: List[FrameAudioLevel] = []
+    needs_audio = True
+    frames_audio_levels: np.ndarray = np.empty(0)
 
     @classmethod
     def setup(cls, setup_data: SetupData):
-        cls.frames_audio_levels = ffmpeg_util.get_frames_audio_levels(setup_data.video_path)
+        cls.frames_audio_levels = AudioLevels.get(setup_data.video_path, setup_data.fps, setup_data.cache_dir)
 
     @classmethod
     def get_frame_bounds(cls, data: Data) -> FrameBounds:
         if data.frame_index == 0:
             return FrameBounds(width=data.width)
 
-        fal = cls.frames_audio_levels[
+        percent_max = cls.frames_audio_levels[
             max(
                 min(
                     math.floor((data.frame_index / (data.num_frames - 1)) * (len(cls.frames_audio_levels) - 1)),
@@ -27,4 +29,12 @@ class Mode(ModeBase):
                 0,
             )
         ]
-        return FrameBounds(width=math.floor(abs(data.width * fal.percent_max)))
+        return FrameBounds(width=math.floor(abs(data.width * percent_max)))
+
+    @classmethod
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        levels = cls.frames_audio_levels
+        level_indices = np.floor((frame_indices / max(base_data.num_frames - 1, 1)) * (len(levels) - 1))
+        level_indices = np.maximum(np.minimum(level_indices, len(levels) - 1), 0).astype(int)
+        widths = np.floor(np.abs(base_data.width * levels[level_indices]))
+        return FrameBoundsBatch(width=np.where(frame_indices == 0, base_data.width, widths))
@@ -1,7 +1,9 @@
 import math
 
-from data import Data
-from modes.mode_base import FrameBounds, ModeBase
+import numpy as np
+
+from data import BaseData, Data
+from modes.mode_base import FrameBounds, FrameBoundsBatch, ModeBase
 
 
 class Mode(ModeBase):
@@ -13,3 +15,10 @@ class Mode(ModeBase):
         return FrameBounds(
             height=math.floor(abs(math.cos((data.frame_index / (data.fps / data.tempo)) * math.pi) * data.height))
         )
+
+    @classmethod
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        heights = np.floor(
+            np.abs(np.cos((frame_indices / (base_data.fps / base_data.tempo)) * np.pi) * base_data.height)
+        )
+        return FrameBoundsBatch(height=np.where(frame_indices == 0, base_data.height, heights))
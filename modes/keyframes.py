@@ -1,13 +1,31 @@
+import hashlib
 import math
+import operator
 import re
-from dataclasses import dataclass
+from dataclasses import astuple, dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
 
 import localization
-from data import Data, SetupData
+from data import BaseData, Data, SetupData
 from localization import localize_str
-from modes.mode_base import FrameBounds, ModeBase
+from modes.mode_base import FrameBounds, FrameBoundsBatch, ModeBase
+from util.cache_util import get_cache_dir, get_file_digest, read_json, write_json
+
+_TIME_SEPARATORS = re.compile('[:.-]')
+_TOKENS = re.compile(r'\s*(?:(\d+)|([a-z]+)|([+\-*/()]))')
+_OPERATORS: Dict[str, Callable[[float, float], float]] = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+_VARIABLES = ('last', 'lastwidth', 'lastheight', 'original')
+# bump whenever parsing changes, so keyframes cached by older versions are not reused
+_PARSER_VERSION = 'compiled-expressions-1'
 
 
 class NumberOfFieldsInvalidException(Exception):
@@ -22,6 +40,10 @@ class InterpolationModeNotImplementedException(Exception):
     ...
 
 
+class ExpressionInvalidException(Exception):
+    ...
+
+
 @dataclass
 class KeyframeData:
     time: int
@@ -33,202 +55,233 @@ class KeyframeData:
         return self.width, self.height
 
 
-@dataclass
-class InterpolationData:
-    t: float
-    width: int
-    height: int
-    next_width: int
-    next_height: int
+def _linear(t: np.ndarray, width: np.ndarray, height: np.ndarray, next_width: np.ndarray, next_height: np.ndarray):
+    return np.floor(width + t * (next_width - width)), np.floor(height + t * (next_height - height))
 
 
-class Mode(ModeBase):
-    keyframes: List[KeyframeData] = []
-    kf_index = 0
-    interp_modes: Dict[str, Callable[[InterpolationData], FrameBounds]] = {}
+def _instant(t: np.ndarray, width: np.ndarray, height: np.ndarray, next_width: np.ndarray, next_height: np.ndarray):
+    return width, height
 
-    @classmethod
-    def interpolation(
-        cls, mode: Optional[str] = None, data: Optional[InterpolationData] = None
-    ) -> Optional[FrameBounds]:
-        def linear(data: InterpolationData):
-            return FrameBounds(
-                width=math.floor(data.width + data.t * (data.next_width - data.width)),
-                height=math.floor(data.height + data.t * (data.next_height - data.height)),
-            )
 
-        def instant(data: InterpolationData):
-            return FrameBounds(width=data.width, height=data.height)
+# vectorized over frames: (t, width, height, next_width, next_height) -> (widths, heights)
+INTERPOLATIONS: Dict[str, Callable[..., Tuple[np.ndarray, np.ndarray]]] = {'linear': _linear, 'instant': _instant}
+
 
-        if mode and data:
-            return cls.interp_modes[mode](data)
+class KeyframeTimeline:
+    """Keyframes compiled into arrays, so the bounds of any frames can be looked up in any order.
 
-        lcls = dict(locals())  # copy to dict to prevent error
-        cls.interp_modes = {k: v for k, v in lcls.items() if callable(v) and k != 'cls'}
-        return
+    A frame belongs to the keyframe before the first later keyframe whose time hasn't come yet, and interpolates
+    from it towards that later keyframe. Keyframes out of order are skipped the same way playing through the
+    frames one after another would skip them.
+    """
+
+    __slots__ = ('times', 'widths', 'heights', 'interp_modes', 'reached_by')
+
+    def __init__(self, keyframes: List[KeyframeData]) -> None:
+        self.times = np.array([keyframe.time for keyframe in keyframes], dtype=np.int64)
+        self.widths = np.array([keyframe.width for keyframe in keyframes], dtype=float)
+        self.heights = np.array([keyframe.height for keyframe in keyframes], dtype=float)
+        self.interp_modes = np.array([keyframe.interp_mode for keyframe in keyframes])
+        # keyframe i + 1 is reached once the frame index gets to the latest time up to and including it
+        self.reached_by = np.maximum.accumulate(self.times)[1:]
+
+    def keyframe_indices(self, frame_indices: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.reached_by, frame_indices, side='right')
+
+    def bounds(self, frame_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        current = self.keyframe_indices(frame_indices)
+        following = np.minimum(current + 1, len(self.times) - 1)
+        widths, heights = self.widths[current], self.heights[current]
+
+        interpolating = current != following  # frames past the last keyframe keep its size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (frame_indices - self.times[current]) / (self.times[following] - self.times[current])
+        for interp_mode, interpolate in INTERPOLATIONS.items():
+            selected = interpolating & (self.interp_modes[current] == interp_mode)
+            if selected.any():
+                widths[selected], heights[selected] = interpolate(
+                    t[selected],
+                    widths[selected],
+                    heights[selected],
+                    self.widths[following[selected]],
+                    self.heights[following[selected]],
+                )
+        return widths, heights
+
+    def excess_keyframes(self, frame_indices: np.ndarray) -> List[int]:
+        """Keyframes reached by a frame that had to pass more than one keyframe, going through the frames in order."""
+        current = np.concatenate(([0], self.keyframe_indices(frame_indices)))
+        jumps = np.flatnonzero(np.diff(current) > 1)
+        return [index for jump in jumps.tolist() for index in range(current[jump] + 2, current[jump + 1] + 1)]
+
+
+class Mode(ModeBase):
+    keyframes: List[KeyframeData] = []
+    parsed: Dict[str, List[KeyframeData]] = {}  # parsed keyframe files by content and video
+    timeline = KeyframeTimeline([KeyframeData(0, 0, 0, 'linear')])
 
     @classmethod
     def setup(cls, setup_data: SetupData):
         localization.print('parsing_keyframes', args={'file': setup_data.keyframe_file})
-        cls.interpolation()
-        cls.parse_keyframe_file(setup_data.keyframe_file, setup_data.fps, setup_data.width, setup_data.height)
+        cls.keyframes = cls.parse_keyframe_file(
+            setup_data.keyframe_file, setup_data.fps, setup_data.width, setup_data.height, setup_data.cache_dir
+        )
+        cls.timeline = KeyframeTimeline(cls.keyframes)
 
     @classmethod
     def get_frame_bounds(cls, data: Data) -> FrameBounds:
-        incremented = False
-        while cls.kf_index != len(cls.keyframes) - 1 and data.frame_index >= cls.keyframes[cls.kf_index + 1].time:
-            if incremented:
-                localization.print('excess_keyframes', args={'time': cls.keyframes[cls.kf_index + 1].time})
-            cls.kf_index += 1
-            incremented = True
-
-        if cls.kf_index == len(cls.keyframes) - 1:
-            return FrameBounds(
-                width=cls.keyframes[cls.kf_index].width,
-                height=cls.keyframes[cls.kf_index].height,
-            )
-
-        t = (data.frame_index - cls.keyframes[cls.kf_index].time) / (
-            cls.keyframes[cls.kf_index + 1].time - cls.keyframes[cls.kf_index].time
-        )
-        width, height = cls.keyframes[cls.kf_index].get_shape()
-        next_width, next_height = cls.keyframes[cls.kf_index + 1].get_shape()
-
-        return cls.interpolation(
-            cls.keyframes[cls.kf_index].interp_mode,
-            InterpolationData(t, width, height, next_width, next_height),
-        )
+        widths, heights = cls.timeline.bounds(np.array([data.frame_index]))
+        return FrameBounds(width=int(widths[0]), height=int(heights[0]))
 
     @classmethod
-    def parse_keyframe_file(cls, keyframe_file: Path, fps: float, width: int, height: int):
-        file_lines = keyframe_file.read_text().splitlines()
-        lines: List[List[int, List[str]]] = []
-        for i, line in enumerate(file_lines, start=1):
-            if not (line == '' or line.startswith('#')):
-                lines.append([i, [x.strip().lower() for x in line.split(',')]])
-
-        # validate keyframes
-        for prev_kf_index, [line_i, data] in enumerate(lines, start=-1):
-            if not (3 <= len(data) <= 4):
-                raise NumberOfFieldsInvalidException(
-                    localize_str(
-                        'not_enough_fields' if len(data) < 3 else 'too_many_fields',
-                        args={'line': line_i},
-                    )
-                )
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        for index in cls.timeline.excess_keyframes(frame_indices):
+            localization.print('excess_keyframes', args={'time': int(cls.timeline.times[index])})
+        widths, heights = cls.timeline.bounds(frame_indices)
+        return FrameBoundsBatch(width=widths, height=heights)
 
-            time = [int(x) if x.isdecimal() else None for x in re.split('[:.-]', data[0])]
-            if not (1 <= len(time) <= 2) or None in time:
-                raise TimeInvalidException(
-                    localize_str(
-                        'invalid_time',
-                        args={'line': line_i, 'input': data[0]},
-                    )
-                )
-
-            parsed_time = math.floor(time[0] * fps)
-            if len(time) == 2:
-                parsed_time += time[1]
-                if time[1] >= fps:
-                    localization.print('large_frame_specifier', args={'line': line_i})
-
-            interpolation = 'linear'  # default
-            if len(data) == 4 and cls.is_interp_mode_valid(data[3]):
-                interpolation = data[3]
-
-            cls.keyframes.append(
-                KeyframeData(
-                    parsed_time,
-                    cls.eval_expression(data[1], prev_kf_index, width),
-                    cls.eval_expression(data[2], prev_kf_index, height, side_is_width=False),
-                    interpolation,
-                )
-            )
-
-        if cls.keyframes[0].time != 0:
-            cls.keyframes.insert(0, KeyframeData(0, width, height, 'linear'))
+    @classmethod
+    def parse_keyframe_file(
+        cls, keyframe_file: Path, fps: float, width: int, height: int, cache_dir: Optional[Path] = None
+    ) -> List[KeyframeData]:
+        """Parses the keyframe file, reusing what an earlier parse of the same content and video found."""
+        cache_dir = get_cache_dir(cache_dir)
+        key = hashlib.sha256(
+            f'{get_file_digest(keyframe_file, cache_dir)}:{fps!r}:{width}:{height}:{_PARSER_VERSION}'.encode()
+        ).hexdigest()
+        if key in cls.parsed:
+            return cls.parsed[key]
+
+        parsed_path = cache_dir / 'keyframes' / f'{key}.json'
+        parsed = read_json(parsed_path)
+        if 'keyframes' in parsed:
+            cls.parsed[key] = [KeyframeData(*keyframe) for keyframe in parsed['keyframes']]
+            return cls.parsed[key]
+
+        cls.parsed[key] = parse_keyframes(keyframe_file.read_text(), fps, width, height)
+        parsed_path.parent.mkdir(exist_ok=True)
+        write_json(parsed_path, {'keyframes': [astuple(keyframe) for keyframe in cls.parsed[key]]})
+        return cls.parsed[key]
 
     @classmethod
     def is_interp_mode_valid(cls, mode: str):
-        if mode not in cls.interp_modes:
+        if mode not in INTERPOLATIONS:
             raise InterpolationModeNotImplementedException(
                 localize_str("unrecognized_interpolation", args={'mode': mode})
             )
         return True
 
-    @classmethod
-    def eval_expression(cls, expression: str, prev_kf_index: int, side: int, side_is_width: bool = True):
-        def infix_to_postfix():
-            @dataclass
-            class Operator:
-                precedence: int
-                associativity: str
-
-                def is_left_assoc(self):
-                    return self.associativity == 'left'
-
-                def is_right_assoc(self):
-                    return self.associativity == 'right'
-
-            operators = {
-                '/': Operator(precedence=2, associativity='left'),
-                '*': Operator(precedence=2, associativity='left'),
-                '+': Operator(precedence=1, associativity='left'),
-                '-': Operator(precedence=1, associativity='left'),
-            }
-
-            postfix: List[Union[str, int]] = []
-            operator_stack: List[str] = []
-            tokens = [x for x in re.split(r'([+\-*/()])', expression) if x != '']
-            for token in tokens:
-                if re.search(r'^\d+$', token):
-                    postfix.append(int(token))
-                elif token in operators:
-                    if operator_stack:
-                        o1 = token
-                        o2 = operator_stack[-1]
-                        if (operators[o1].is_left_assoc() and operators[o1].precedence <= operators[o2].precedence) or (
-                            operators[o1].is_right_assoc() and operators[o1].precedence < operators[o2].precedence
-                        ):
-                            postfix.append(operator_stack.pop())
-                    operator_stack.append(token)
-                elif token == '(':
-                    operator_stack.append(token)
-                elif token == ')':
-                    while operator_stack[-1] != '(':
-                        postfix.append(operator_stack.pop())
-                    operator_stack.pop()
-                else:
-                    postfix.append(token.lower())
-
-            while operator_stack:
-                postfix.append(operator_stack.pop())
-            return postfix
-
-        def evaulate_postfix(postfix: List[Union[str, int]]) -> int:
-            queue: List[int] = []
-            for token in postfix:
-                if isinstance(token, int):
-                    queue.append(token)
-                elif token == '+':
-                    queue.append(queue.pop() + queue.pop())
-                elif token == '-':
-                    queue.append(-queue.pop() + queue.pop())
-                elif token == '*':
-                    queue.append(queue.pop() * queue.pop())
-                elif token == '/':
-                    queue.append(queue.pop() / queue.pop())
-                elif token.startswith('last'):
-                    if token.endswith('width'):
-                        queue.append(cls.keyframes[prev_kf_index].width)
-                    elif token.endswith('height'):
-                        queue.append(cls.keyframes[prev_kf_index].height)
-                    elif token == 'last':
-                        kf = cls.keyframes[prev_kf_index]
-                        queue.append(kf.width if side_is_width else kf.height)
-                elif token == 'original':
-                    queue.append(side)
-
-            return math.floor(queue[0])
-
-        return evaulate_postfix(infix_to_postfix())
+
+def parse_keyframes(text: str, fps: float, width: int, height: int) -> List[KeyframeData]:
+    lines: List[Tuple[int, List[str]]] = []
+    for i, line in enumerate(text.splitlines(), start=1):
+        if not (line == '' or line.startswith('#')):
+            lines.append((i, [x.strip().lower() for x in line.split(',')]))
+
+    keyframes: List[KeyframeData] = []
+    # validate keyframes
+    for line_i, data in lines:
+        if not (3 <= len(data) <= 4):
+            raise NumberOfFieldsInvalidException(
+                localize_str(
+                    'not_enough_fields' if len(data) < 3 else 'too_many_fields',
+                    args={'line': line_i},
+                )
+            )
+
+        time = [int(x) if x.isdecimal() else None for x in _TIME_SEPARATORS.split(data[0])]
+        if not (1 <= len(time) <= 2) or None in time:
+            raise TimeInvalidException(
+                localize_str(
+                    'invalid_time',
+                    args={'line': line_i, 'input': data[0]},
+                )
+            )
+
+        parsed_time = math.floor(time[0] * fps)
+        if len(time) == 2:
+            parsed_time += time[1]
+            if time[1] >= fps:
+                localization.print('large_frame_specifier', args={'line': line_i})
+
+        interpolation = 'linear'  # default
+        if len(data) == 4 and Mode.is_interp_mode_valid(data[3]):
+            interpolation = data[3]
+
+        # the first keyframe continues from the video's original size
+        last_width, last_height = keyframes[-1].get_shape() if keyframes else (width, height)
+        variables = {'lastwidth': last_width, 'lastheight': last_height}
+        sizes = []
+        for expression, last, original in ((data[1], last_width, width), (data[2], last_height, height)):
+            try:
+                sizes.append(
+                    math.floor(compile_expression(expression)({**variables, 'last': last, 'original': original}))
+                )
+            except (ValueError, ZeroDivisionError) as error:
+                raise ExpressionInvalidException(
+                    localize_str('invalid_expression', args={'line': line_i, 'input': expression})
+                ) from error
+
+        keyframes.append(KeyframeData(parsed_time, sizes[0], sizes[1], interpolation))
+
+    if not keyframes or keyframes[0].time != 0:
+        keyframes.insert(0, KeyframeData(0, width, height, 'linear'))
+    return keyframes
+
+
+Expression = Callable[[Dict[str, int]], float]
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression: str) -> Expression:
+    """Compiles a size expression like `last*2` or `(original+lastwidth)/2` into a function of its variables.
+
+    Numbers and the variables `last`, `lastwidth`, `lastheight` and `original` can be combined with `+ - * /` and
+    parentheses, with the usual precedence. Raises ValueError if the expression is invalid.
+    """
+    tokens: List[str] = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKENS.match(expression, position)
+        if match is None:
+            raise ValueError(expression)
+        tokens.append(match.group(match.lastindex))  # type: ignore
+        position = match.end()
+    tokens.reverse()  # consumed from the end
+
+    def parse_sum() -> Expression:
+        node = parse_product()
+        while tokens and tokens[-1] in ('+', '-'):
+            node = binary(_OPERATORS[tokens.pop()], node, parse_product())
+        return node
+
+    def parse_product() -> Expression:
+        node = parse_operand()
+        while tokens and tokens[-1] in ('*', '/'):
+            node = binary(_OPERATORS[tokens.pop()], node, parse_operand())
+        return node
+
+    def parse_operand() -> Expression:
+        if not tokens:
+            raise ValueError(expression)
+        token = tokens.pop()
+        if token.isdecimal():
+            number = int(token)
+            return lambda variables: number
+        if token in _VARIABLES:
+            return lambda variables: variables[token]
+        if token == '(':
+            node = parse_sum()
+            if not tokens or tokens.pop() != ')':
+                raise ValueError(expression)
+            return node
+        raise ValueError(expression)
+
+    def binary(function: Callable[[float, float], float], left: Expression, right: Expression) -> Expression:
+        return lambda variables: function(left(variables), right(variables))
+
+    compiled = parse_sum()
+    if tokens:
+        raise ValueError(expression)
+    return compiled
@@ -1,8 +1,10 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict, Optional, Union
+from typing import List, Optional
 
-from data import Data, SetupData
+import numpy as np
+
+from data import BaseData, Data, SetupData
 
 
 def load_modes():
@@ -36,15 +38,25 @@ class FrameBounds:
         )
 
 
-class FrameAudioLevel:
-    __slots__ = ('dbs', 'percent_max')
+class FrameBoundsBatch:
+    """Frame bounds of many frames at once. NaN in `width`/`height` and None in `vf_command` mean "not set"."""
+
+    __slots__ = ('width', 'height', 'vf_command')
 
-    def __init__(self, frame_dbs: Dict[str, Dict[str, Union[str, float]]]) -> None:
-        self.dbs = float(frame_dbs['tags']['lavfi.astats.Overall.RMS_level'])
-        self.percent_max = 0.0
+    def __init__(
+        self,
+        width: Optional[np.ndarray] = None,
+        height: Optional[np.ndarray] = None,
+        vf_command: Optional[List[Optional[str]]] = None,
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.vf_command = vf_command
 
 
 class ModeBase(ABC):
+    needs_audio = False
+
     @classmethod
     def setup(cls, setup_data: SetupData):
         pass
@@ -53,3 +65,30 @@ class ModeBase(ABC):
     @abstractmethod
     def get_frame_bounds(cls, data: Data) -> FrameBounds:
         pass
+
+    @classmethod
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        # fallback for modes without a vectorized implementation
+        widths = np.full(len(frame_indices), np.nan)
+        heights = np.full(len(frame_indices), np.nan)
+        vf_commands: List[Optional[str]] = [None] * len(frame_indices)
+        for i, frame_index in enumerate(frame_indices.tolist()):
+            frame_bounds = cls.get_frame_bounds(Data(base_data, frame_index, None))
+            if frame_bounds.width is not None:
+                widths[i] = frame_bounds.width
+            if frame_bounds.height is not None:
+                heights[i] = frame_bounds.height
+            if frame_bounds.vf_command is not None:
+                vf_commands[i] = frame_bounds.vf_command[0]
+
+        return FrameBoundsBatch(
+            width=None if np.isnan(widths).all() else widths,
+            height=None if np.isnan(heights).all() else heights,
+            vf_command=vf_commands if any(vf_commands) else None,
+        )
+
+    @classmethod
+    def get_segment_bounds(cls, base_data: BaseData, start: int, frame_count: int) -> Optional[FrameBounds]:
+        """Filter that renders the frames `start` to `start + frame_count - 1` in one go, for modes whose filter
+        changes every frame, and the size it renders them at. None keeps the filter of the segment's first frame."""
+        return None
@@ -1,7 +1,10 @@
 import math
+from typing import Optional, Tuple
 
-from data import Data
-from modes.mode_base import FrameBounds, ModeBase
+import numpy as np
+
+from data import BaseData, Data
+from modes.mode_base import FrameBounds, FrameBoundsBatch, ModeBase
 
 
 class Mode(ModeBase):
@@ -14,11 +17,55 @@ class Mode(ModeBase):
                 height=max_size,
             )
 
-        angle = data.frame_index * (data.angle / data.num_frames)
-        width = math.floor(max(data.width, data.width * abs(math.cos(angle)) + data.height * abs(math.sin(angle))))
-        height = math.floor(max(data.height, data.width * abs(math.sin(angle)) + data.height * abs(math.cos(angle))))
+        widths, heights = cls.get_rotated_sizes(data, np.array([data.frame_index]))
+        return FrameBounds(
+            width=int(widths[0]),
+            height=int(heights[0]),
+            vf_command=rotate_vf_command(
+                int(widths[0]), int(heights[0]), data.frame_index, data.angle / data.num_frames
+            ),
+        )
+
+    @classmethod
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        widths, heights = cls.get_rotated_sizes(base_data, frame_indices)
+        max_size = math.floor(
+            base_data.width * abs(math.cos(math.pi / 4)) + base_data.height * abs(math.cos(math.pi / 4))
+        )
+        step = base_data.angle / base_data.num_frames
+        first = frame_indices == 0
+        vf_commands = [
+            None if is_first else rotate_vf_command(w, h, frame_index, step)
+            for is_first, w, h, frame_index in zip(
+                first.tolist(), widths.astype(int).tolist(), heights.astype(int).tolist(), frame_indices.tolist()
+            )
+        ]
+        return FrameBoundsBatch(
+            width=np.where(first, max_size, widths),
+            height=np.where(first, max_size, heights),
+            vf_command=vf_commands,
+        )
+
+    @classmethod
+    def get_segment_bounds(cls, base_data: BaseData, start: int, frame_count: int) -> Optional[FrameBounds]:
+        widths, heights = cls.get_rotated_sizes(base_data, np.arange(start, start + frame_count))
+        width, height = int(widths.max()), int(heights.max())
         return FrameBounds(
             width=width,
             height=height,
-            vf_command=f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,rotate={angle:.2f}:bilinear=0',
+            vf_command=rotate_vf_command(width, height, start, base_data.angle / base_data.num_frames),
         )
+
+    @staticmethod
+    def get_rotated_sizes(base_data: BaseData, frame_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        width, height = base_data.width, base_data.height
+        angles = frame_indices * (base_data.angle / base_data.num_frames)
+        cos, sin = np.abs(np.cos(angles)), np.abs(np.sin(angles))
+        widths = np.floor(np.maximum(width, width * cos + height * sin))
+        heights = np.floor(np.maximum(height, width * sin + height * cos))
+        return widths, heights
+
+
+def rotate_vf_command(width: int, height: int, start: int, step: float) -> str:
+    # a canvas fitting every frame rotated, and the angle of each frame from its number `n` within the segment
+    return f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,rotate=(n+{start})*{step!r}:bilinear=0'
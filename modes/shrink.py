@@ -1,10 +1,17 @@
 import math
 
-from data import Data
-from modes.mode_base import FrameBounds, ModeBase
+import numpy as np
+
+from data import BaseData, Data
+from modes.mode_base import FrameBounds, FrameBoundsBatch, ModeBase
 
 
 class Mode(ModeBase):
     @classmethod
     def get_frame_bounds(cls, data: Data) -> FrameBounds:
         return FrameBounds(height=max(1, math.floor(data.height - (data.frame_index / data.num_frames) * data.height)))
+
+    @classmethod
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        heights = np.floor(base_data.height - (frame_indices / base_data.num_frames) * base_data.height)
+        return FrameBoundsBatch(height=np.maximum(1, heights))
@@ -1,8 +1,10 @@
 import math
 import random
 
-from data import Data
-from modes.mode_base import FrameBounds, ModeBase
+import numpy as np
+
+from data import BaseData, Data
+from modes.mode_base import FrameBounds, FrameBoundsBatch, ModeBase
 
 
 class Mode(ModeBase):
@@ -15,3 +17,12 @@ class Mode(ModeBase):
             width=math.floor(random.random() * data.width),
             height=math.floor(random.random() * data.height),
         )
+
+    @classmethod
+    def get_frame_bounds_batch(cls, base_data: BaseData, frame_indices: np.ndarray) -> FrameBoundsBatch:
+        widths = np.floor(np.random.random(len(frame_indices)) * base_data.width)
+        heights = np.floor(np.random.random(len(frame_indices)) * base_data.height)
+        return FrameBoundsBatch(
+            width=np.where(frame_indices == 0, base_data.width, widths),
+            height=np.where(frame_indices == 0, base_data.height, heights),
+        )
@@ -0,0 +1,226 @@
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data import BaseData
+from modes.mode_base import ModeBase
+
+# weights of the relative encoding cost, not measured: one unit per this many pixels one libvpx (vp8) encoder
+# thread encodes, and the cost of starting one ffmpeg process in the same units
+ENCODE_PIXELS_PER_UNIT = 4_000_000
+PROCESS_START_UNITS = 0.15
+
+
+@dataclass(frozen=True)
+class Segment:
+    start: int  # 1-based index of the first frame, same numbering as the extracted frame files
+    frame_count: int
+    width: int
+    height: int
+    vf_command: Optional[str] = None
+
+    @property
+    def end(self) -> int:
+        return self.start + self.frame_count - 1
+
+    @property
+    def name(self) -> str:
+        return f'{self.start:05d}'
+
+    @property
+    def estimated_cost(self) -> int:
+        # encoding time grows with the number of pixels to encode
+        return self.frame_count * self.width * self.height
+
+
+@dataclass(frozen=True)
+class SegmentPlan:
+    width: int
+    height: int
+    fps: str
+    num_frames: int
+    delta: int
+    segments: Tuple[Segment, ...]
+    max_error: int = 0  # see get_max_error
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SegmentPlan':
+        return cls(**{**data, 'segments': tuple(Segment(**segment) for segment in data['segments'])})
+
+
+def plan_frame_bounds(
+    modes: Dict[str, ModeBase],
+    selected_modes: List[str],
+    base_data: BaseData,
+    delta: int,
+    smoothing: int,
+) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]]]:
+    frame_indices = np.arange(base_data.num_frames)
+    widths = np.full(base_data.num_frames, base_data.width, dtype=float)
+    heights = np.full(base_data.num_frames, base_data.height, dtype=float)
+    vf_commands: List[Optional[str]] = [None] * base_data.num_frames
+
+    for mode in selected_modes:
+        batch = modes[mode].get_frame_bounds_batch(base_data, frame_indices)
+        if batch.width is not None:
+            widths = np.where(np.isnan(batch.width), widths, batch.width)
+        if batch.height is not None:
+            heights = np.where(np.isnan(batch.height), heights, batch.height)
+        if batch.vf_command is not None:
+            vf_commands = [new if new is not None else old for old, new in zip(vf_commands, batch.vf_command)]
+
+    widths = np.maximum(np.minimum(widths, base_data.width), delta).astype(np.int64)
+    heights = np.maximum(np.minimum(heights, base_data.height), delta).astype(np.int64)
+
+    if smoothing:
+        widths = _smooth(widths, base_data.width, smoothing)
+        heights = _smooth(heights, base_data.height, smoothing)
+
+    return widths, heights, vf_commands
+
+
+def _smooth(sizes: np.ndarray, original: int, smoothing: int) -> np.ndarray:
+    # moving average over the last `smoothing` frames, with the window starting out filled with the original size
+    padded = np.concatenate((np.full(smoothing, original, dtype=np.int64), sizes))
+    cumulative = np.concatenate(([0], np.cumsum(padded)))
+    return (cumulative[smoothing + 1 :] - cumulative[1:-smoothing]) // smoothing
+
+
+def _half_range_error(sizes: np.ndarray) -> np.ndarray:
+    # largest distance of the sizes so far from the middle of their range
+    return (np.maximum.accumulate(sizes) - np.minimum.accumulate(sizes) + 1) // 2
+
+
+def split_segments(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    vf_commands: List[Optional[str]],
+    compression: int,
+    max_segment_length: int,
+) -> Tuple[Segment, ...]:
+    """Splits the frames into as few segments as possible, each rendered at one size.
+
+    A segment is rendered at the middle of its frames' width and height ranges, so no frame ends up more than
+    `compression` pixels (width and height differences added up) off its own size. Any run of frames inside a
+    segment that fits this budget fits it as well, which makes taking the longest fitting segment at every step
+    give the fewest segments, and so the fewest ffmpeg processes.
+    """
+    num_frames = len(widths)
+    segments: List[Segment] = []
+    max_segment_length = max(1, max_segment_length)
+    compression = max(0, compression)
+
+    start = 0
+    while start < num_frames:
+        limit = min(start + max_segment_length, num_frames)
+        end = limit
+        # gallop through the candidates so tiny segments do not pay for scanning `max_segment_length` frames
+        step = 16
+        while True:
+            hi = min(start + step, limit)
+            errors = _half_range_error(widths[start:hi]) + _half_range_error(heights[start:hi])
+            exceeded = np.flatnonzero(errors > compression)
+            if len(exceeded):
+                # a single frame always fits, but never let a segment end up empty
+                end = start + max(1, int(exceeded[0]))
+                break
+            if hi == limit:
+                break
+            step *= 2
+
+        segment_widths, segment_heights = widths[start:end], heights[start:end]
+        segments.append(
+            Segment(
+                start=start + 1,
+                frame_count=end - start,
+                width=int(segment_widths.min() + segment_widths.max()) // 2,
+                height=int(segment_heights.min() + segment_heights.max()) // 2,
+                vf_command=vf_commands[start],
+            )
+        )
+        start = end
+    return tuple(segments)
+
+
+def apply_segment_vf_commands(
+    modes: Dict[str, ModeBase], selected_modes: List[str], base_data: BaseData, segments: Tuple[Segment, ...]
+) -> Tuple[Segment, ...]:
+    """Lets modes replace the first frame's filter with one covering the whole segment, along with the size that
+    filter renders at, later modes taking priority like they do for frame bounds."""
+    applied = []
+    for segment in segments:
+        for mode in selected_modes:
+            bounds = modes[mode].get_segment_bounds(base_data, segment.start - 1, segment.frame_count)
+            if bounds is not None:
+                segment = replace(
+                    segment,
+                    width=segment.width if bounds.width is None else bounds.width,
+                    height=segment.height if bounds.height is None else bounds.height,
+                    vf_command=bounds.vf_command[0] if bounds.vf_command else segment.vf_command,
+                )
+        applied.append(segment)
+    return tuple(applied)
+
+
+def get_max_error(segments: Tuple[Segment, ...], widths: np.ndarray, heights: np.ndarray) -> int:
+    """Largest difference, in pixels of width and height added up, between a frame's size and its segment's."""
+    if not segments:
+        return 0
+    frame_counts = [segment.frame_count for segment in segments]
+    rendered_widths = np.repeat([segment.width for segment in segments], frame_counts)
+    rendered_heights = np.repeat([segment.height for segment in segments], frame_counts)
+    return int(np.max(np.abs(widths - rendered_widths) + np.abs(heights - rendered_heights)))
+
+
+def build_segment_plan(
+    modes: Dict[str, ModeBase],
+    selected_modes: List[str],
+    base_data: BaseData,
+    fps: str,
+    delta: int,
+    smoothing: int,
+    compression: int,
+    threads: int,
+    frame_window: int = 0,
+) -> SegmentPlan:
+    """With a `frame_window`, segments are kept short enough that every encoder thread can have one in the window."""
+    widths, heights, vf_commands = plan_frame_bounds(modes, selected_modes, base_data, delta, smoothing)
+    max_segment_length = base_data.num_frames // threads
+    if frame_window:
+        max_segment_length = min(max_segment_length, max(1, frame_window // threads))
+    segments = split_segments(widths, heights, vf_commands, compression, max_segment_length)
+    segments = apply_segment_vf_commands(modes, selected_modes, base_data, segments)
+    return SegmentPlan(
+        width=base_data.width,
+        height=base_data.height,
+        fps=fps,
+        num_frames=base_data.num_frames,
+        delta=delta,
+        segments=segments,
+        max_error=get_max_error(segments, widths, heights),
+    )
+
+
+def estimate_encode_cost(plan: SegmentPlan, threads: int, frame_transport: str) -> Dict[str, Any]:
+    """Rough cost of rendering `plan` on `threads` threads, assuming the encoders keep every thread busy.
+
+    The cost is in relative units rather than seconds, only meant to compare plans with each other; the real time
+    depends on the machine, the encoder settings and the content, which benchmark.py measures.
+    """
+    pixels = sum(segment.estimated_cost for segment in plan.segments)
+    # one encoder per segment, plus splitting off the audio, concatenating and, unless seeking, splitting the frames
+    processes = len(plan.segments) + (2 if frame_transport == 'seek' else 3)
+    longest = max((segment.estimated_cost for segment in plan.segments), default=0)
+    cost = max(pixels / max(1, threads), longest) / ENCODE_PIXELS_PER_UNIT
+    cost += processes * PROCESS_START_UNITS / max(1, threads)
+    return {
+        'segments': len(plan.segments),
+        'ffmpeg_processes': processes,
+        'frames': plan.num_frames,
+        'pixels': pixels,
+        'relative_cost': round(cost, 1),
+    }
@@ -0,0 +1,343 @@
+import argparse
+import hmac
+import itertools
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import localization
+import util.args_util as args_util
+import util.ffmpeg_util as ffmpeg_util
+import wackypywebm
+from batch import BatchJob, options_to_flags, parse_job
+from util.progress import ProgressEvent
+from util.scheduler import SegmentScheduler
+
+
+class ServerJob:
+    __slots__ = (
+        'id',
+        'job',
+        'state',
+        'frames_done',
+        'total_frames',
+        'disk_estimate',
+        'output',
+        'error',
+        'submitted_at',
+        'started_at',
+        'finished_at',
+    )
+
+    def __init__(self, job_id: str, job: BatchJob, output: Path, total_frames: int, disk_estimate: int) -> None:
+        self.id = job_id
+        self.job = job
+        self.state = 'queued'  # queued, running, done, failed or cancelled
+        self.frames_done = 0
+        self.total_frames = total_frames
+        self.disk_estimate = disk_estimate
+        self.output = output
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'file': str(self.job.file),
+            'modes': self.job.modes,
+            'options': self.job.options,
+            'output': str(self.output),
+            'state': self.state,
+            'frames_done': self.frames_done,
+            'total_frames': self.total_frames,
+            'percent': round(100 * self.frames_done / self.total_frames, 1) if self.total_frames else 0.0,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+def estimate_disk_usage(
+    width: int, height: int, num_frames: int, transparent: bool, frame_transport: str, frame_window: int = 0
+) -> int:
+    """Upper bound of the temporary disk space a render needs, in bytes."""
+    frame_size = width * height * (4 if transparent else 3)
+    if frame_transport == 'overlap' and frame_window > 0:
+        num_frames = min(num_frames, frame_window)
+    # extracted pngs are at most as large as the raw frames, and the encoded segments are far smaller than that
+    return num_frames * frame_size if frame_transport in ('png', 'overlap') else 0
+
+
+class JobServer:
+    """Queues renders and runs them in this process, so modes, locale and caches stay loaded between jobs.
+
+    A queued job starts once fewer than `max_jobs` are running and its estimated temporary files fit in what is left
+    of `disk_budget`. Jobs start in submission order, and one job always runs even if it is over the disk budget.
+    Encoders of all running jobs share one scheduler limited to `threads`.
+
+    Jobs can only write inside `output_root`: outputs default to it, and outputs or folders given by a job have to be
+    in it. Folders set by `common_flags` are trusted.
+    """
+
+    def __init__(
+        self, threads: int, max_jobs: int, disk_budget: int, common_flags: List[str], output_root: Path
+    ) -> None:
+        self.scheduler = SegmentScheduler(threads)
+        self.max_jobs = max(1, max_jobs)
+        self.disk_budget = disk_budget
+        self.common_flags = common_flags + ['--threads', str(threads)]
+        self.common_args = args_util.parse_args(['', *self.common_flags])
+        self.output_root = output_root.resolve()
+        self.jobs: Dict[str, ServerJob] = {}
+        self.queue: Deque[ServerJob] = deque()
+        self.running = 0
+        self.disk_reserved = 0
+        self.ids = itertools.count(1)
+        self.condition = threading.Condition()
+        threading.Thread(target=self._admit, daemon=True).start()
+
+    def submit(self, entry: Dict[str, Any]) -> ServerJob:
+        """Queues a {"file", "modes", "options", "output"} job, raising ValueError if it is invalid."""
+        if 'file' not in entry:
+            raise ValueError('Missing "file".')
+        output = entry.get('output')
+        job = BatchJob(
+            Path(entry['file']).resolve(),
+            entry.get('modes', 'bounce'),
+            options_to_flags(entry.get('options', [])),
+            Path(output).resolve() if output else None,
+        )
+        args, selected_modes, output_path = parse_job(job, self.common_flags, self.output_root)
+        self._check_paths(args, output_path)
+        (width, height), _, _, num_frames = ffmpeg_util.get_video_info(job.file)
+        disk_estimate = estimate_disk_usage(
+            width, height, num_frames, 'transparency' in selected_modes, args.frame_transport, args.frame_window
+        )
+
+        with self.condition:
+            server_job = ServerJob(str(next(self.ids)), job, output_path, num_frames, disk_estimate)
+            self.jobs[server_job.id] = server_job
+            self.queue.append(server_job)
+            self.condition.notify_all()
+        return server_job
+
+    def _check_paths(self, args: args_util.IArgs, output_path: Path):
+        """Raises ValueError if the job would write outside `output_root`."""
+        paths = {'output': output_path}
+        for key in ['work_dir', 'cache_dir', 'frame_dir', 'trace', 'profile']:
+            value = getattr(args, key)
+            if value is not None and value != getattr(self.common_args, key):
+                paths[key] = Path(value).resolve()
+        for key, path in paths.items():
+            try:
+                path.relative_to(self.output_root)
+            except ValueError as error:
+                raise ValueError(f'"{key}" has to be inside {self.output_root}.') from error
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a job that hasn't started yet."""
+        with self.condition:
+            server_job = self.jobs.get(job_id)
+            if server_job is None or server_job.state != 'queued':
+                return False
+            self.queue.remove(server_job)
+            server_job.state = 'cancelled'
+            server_job.finished_at = time.time()
+            return True
+
+    def _can_admit(self, server_job: ServerJob) -> bool:
+        if self.running >= self.max_jobs:
+            return False
+        return self.running == 0 or self.disk_reserved + server_job.disk_estimate <= self.disk_budget
+
+    def _admit(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue and self._can_admit(self.queue[0]))
+                server_job = self.queue.popleft()
+                server_job.state = 'running'
+                server_job.started_at = time.time()
+                self.running += 1
+                self.disk_reserved += server_job.disk_estimate
+            threading.Thread(target=self._run, args=(server_job,), daemon=True).start()
+
+    def _run(self, server_job: ServerJob):
+        def on_progress(event: ProgressEvent):
+            server_job.frames_done = event.frames_done
+
+        try:
+            args, selected_modes, output_path = parse_job(server_job.job, self.common_flags, self.output_root)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            plan = wackypywebm.wackify(
+                selected_modes, server_job.job.file, args, output_path, [on_progress], self.scheduler
+            )
+        except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+            server_job.state = 'failed'
+            server_job.error = str(error)
+        else:
+            server_job.state = 'done'
+            server_job.frames_done = server_job.total_frames = plan.num_frames
+        server_job.finished_at = time.time()
+
+        with self.condition:
+            self.running -= 1
+            self.disk_reserved -= server_job.disk_estimate
+            self.condition.notify_all()
+
+    def status(self, job_id: Optional[str] = None) -> Optional[Any]:
+        with self.condition:
+            if job_id is None:
+                return [server_job.to_dict() for server_job in self.jobs.values()]
+            server_job = self.jobs.get(job_id)
+            return server_job.to_dict() if server_job else None
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """JSON API:
+
+    POST /jobs with {"file", "modes", "options", "output"} queues a job, GET /jobs lists all jobs,
+    GET /jobs/<id> shows one and DELETE /jobs/<id> cancels it if it hasn't started yet.
+
+    Every request needs the server's token as "Authorization: Bearer <token>", so web pages the user visits can't
+    queue jobs, and POST bodies have to be sent as application/json.
+    """
+
+    server: 'JobHTTPServer'
+
+    def _authorized(self) -> bool:
+        expected = f'Bearer {self.server.token}'
+        if hmac.compare_digest(self.headers.get('Authorization', '').encode(), expected.encode()):
+            return True
+        self._send_json(401, {'error': 'Missing or wrong token.'})
+        return False
+
+    def _job_id(self) -> Tuple[bool, Optional[str]]:
+        parts = [part for part in self.path.split('/') if part]
+        if not parts or parts[0] != 'jobs' or len(parts) > 2:
+            return False, None
+        return True, parts[1] if len(parts) == 2 else None
+
+    def _send_json(self, status: int, body: Any):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if not self._authorized():
+            return
+        valid, job_id = self._job_id()
+        status = self.server.job_server.status(job_id) if valid else None
+        if status is None:
+            self._send_json(404, {'error': 'Not found.'})
+        else:
+            self._send_json(200, status)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if not self._authorized():
+            return
+        valid, job_id = self._job_id()
+        if not valid or job_id is not None:
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self._send_json(415, {'error': 'Content-Type has to be application/json.'})
+            return
+        try:
+            entry = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            server_job = self.server.job_server.submit(entry)
+        except (ValueError, TypeError, AttributeError) as error:
+            self._send_json(400, {'error': str(error)})
+        except (ffmpeg_util.FFMPEGExcption, OSError) as error:
+            self._send_json(400, {'error': f'Could not probe video: {error}'})
+        else:
+            self._send_json(202, server_job.to_dict())
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        if not self._authorized():
+            return
+        valid, job_id = self._job_id()
+        if not valid or job_id is None:
+            self._send_json(404, {'error': 'Not found.'})
+        elif self.server.job_server.cancel(job_id):
+            self._send_json(200, self.server.job_server.status(job_id))
+        else:
+            self._send_json(409, {'error': 'Job is unknown or already started.'})
+
+
+class JobHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], job_server: JobServer, token: str) -> None:
+        super().__init__(address, RequestHandler)
+        self.job_server = job_server
+        self.token = token
+
+
+PARSER = argparse.ArgumentParser(
+    description='Serves a local JSON API that queues renders and runs them in one warm process. '
+    'Any other option is used as the default of every job, see wackypywebm.py --help.'
+)
+PARSER.add_argument('--host', type=str, default='127.0.0.1', help='Sets the address to listen on.')
+PARSER.add_argument('--port', type=int, default=8765, help='Sets the port to listen on.')
+PARSER.add_argument('-j', '--jobs', type=int, default=2, help='Sets how many jobs can run at once.')
+PARSER.add_argument(
+    '--threads', type=int, default=os.cpu_count(), help='Sets maximum number of encoder threads, shared by all jobs.'
+)
+PARSER.add_argument(
+    '--disk-budget',
+    type=int,
+    help='Sets how many megabytes of temporary files running jobs may need. Defaults to 80%% of the free space.',
+)
+PARSER.add_argument(
+    '--output-root',
+    type=Path,
+    default=Path.cwd(),
+    help='Sets the folder jobs write their outputs to, they can\'t write anywhere else. Defaults to the current folder.',
+)
+PARSER.add_argument(
+    '--token',
+    type=str,
+    default=os.environ.get('WACKYPYWEBM_SERVER_TOKEN'),
+    help='Sets the token requests have to send. Defaults to the WACKYPYWEBM_SERVER_TOKEN environment variable or a '
+    'random one, printed on start.',
+)
+PARSER.add_argument(
+    '-l', '--language', type=str, default='en_us', choices=localization.get_locales(), help='Sets language.'
+)
+
+
+def main(argv: Optional[List[str]] = None):
+    server_args, common_flags = PARSER.parse_known_args(argv)
+    localization.set_locale(server_args.language)
+    if server_args.disk_budget is None:
+        disk_budget = int(shutil.disk_usage(tempfile.gettempdir()).free * 0.8)
+    else:
+        disk_budget = server_args.disk_budget * 1024 * 1024
+
+    token = server_args.token or secrets.token_urlsafe(32)
+    job_server = JobServer(server_args.threads, server_args.jobs, disk_budget, common_flags, server_args.output_root)
+    with JobHTTPServer((server_args.host, server_args.port), job_server, token) as http_server:
+        print(f'Listening on http://{server_args.host}:{server_args.port}/jobs')
+        print(f'Send "Authorization: Bearer {token}" with every request. Outputs go to {job_server.output_root}')
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
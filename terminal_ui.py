@@ -1,5 +1,6 @@
 import argparse
 import os
+import sys
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
@@ -7,7 +8,8 @@ from termcolor import colored
 
 import localization
 import wackypywebm
-from util.args_util import IArgs, get_arg_desc
+from util.args_util import PARSER, IArgs, get_arg_desc
+from util.progress import ProgressEvent
 from util.terminal_util import KeyCodes, get_key_press, terminal_clear
 
 if os.name == 'nt':
@@ -153,9 +155,42 @@ def review_options(flags: Dict[str, Any], file_path: Path):
                 )
             if 'keyframes' not in flags:
                 flags['keyframes'] = None
+            if 'frame_transport' not in flags:
+                flags['frame_transport'] = 'png'
+            if 'frame_store' not in flags:
+                flags['frame_store'] = PARSER.get_default('frame_store')
+            if 'frame_dir' not in flags:
+                flags['frame_dir'] = PARSER.get_default('frame_dir')
+            if 'frame_window' not in flags:
+                flags['frame_window'] = 0
+            if 'cache' not in flags:
+                flags['cache'] = False
+            if 'cache_dir' not in flags:
+                flags['cache_dir'] = None
+            if 'cache_size' not in flags:
+                flags['cache_size'] = 2048
+            if 'trace' not in flags:
+                flags['trace'] = None
+            if 'profile' not in flags:
+                flags['profile'] = None
+            if 'resume' not in flags:
+                flags['resume'] = False
+            if 'work_dir' not in flags:
+                flags['work_dir'] = None
+            if 'plan' not in flags:
+                flags['plan'] = None
+            if 'plan_only' not in flags:
+                flags['plan_only'] = False
             return IArgs(flags)
 
 
+def draw_progress(event: ProgressEvent):
+    bar_width = 40
+    filled = round(bar_width * event.percent / 100)
+    sys.stdout.write(f'\r{colored("#" * filled, "green")}{"." * (bar_width - filled)} {event.percent:5.1f}%')
+    sys.stdout.flush()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--language', choices=localization.get_locales(), default='en_us')
@@ -167,4 +202,10 @@ if __name__ == '__main__':
     FLAGS, FILE_PATH = set_options(KEYS_TO_FLAGS)
     FLAGS = review_options(FLAGS, FILE_PATH)
 
-    wackypywebm.wackify([TerminalUI.modes[TerminalUI.selected_mode]], FILE_PATH, FLAGS, FLAGS.output)
+    wackypywebm.wackify(
+        [TerminalUI.modes[TerminalUI.selected_mode]],
+        FILE_PATH,
+        FLAGS,
+        FLAGS.output,
+        progress_subscribers=[draw_progress],
+    )
@@ -0,0 +1,124 @@
+import shutil
+import sys
+import tempfile
+import textwrap
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import localization
+import util.args_util as args_util
+import wackypywebm
+from util.frame_extractor import FrameExtractor, FrameWindowException
+from util.tmp_paths import TmpPaths
+
+# smallest byte string PngFrameStore reads as one frame: the signature and an IEND chunk
+PNG_FRAME = b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\x00IEND\xaeB`\x82'
+NUM_FRAMES = 50
+
+
+@unittest.skipIf(sys.platform == 'win32', 'the fake ffmpeg is a script run through its shebang')
+class WindowedExtractionTest(unittest.TestCase):
+    """Extracts frames through a window smaller than the video, with a fake ffmpeg that pipes png frames."""
+
+    def setUp(self):
+        localization.set_locale('en_us')
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        fake_ffmpeg = self.folder / 'ffmpeg'
+        fake_ffmpeg.write_text(
+            textwrap.dedent(f'''\
+                #!{sys.executable}
+                import sys
+                for _ in range({NUM_FRAMES}):
+                    sys.stdout.buffer.write({PNG_FRAME!r})
+                '''),
+            encoding='utf-8',
+        )
+        fake_ffmpeg.chmod(0o755)
+        # FrameExtractor adds options of its own, which the fake ignores
+        patcher = mock.patch('util.ffmpeg_util.split_frames_command', side_effect=lambda *_, **__: [fake_ffmpeg])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp_paths = TmpPaths(self.folder / 'work')
+        self.addCleanup(self.tmp_paths.cleanup)
+
+    def extract(self, window: int, segment_length: int) -> int:
+        extractor = FrameExtractor(Path('input.mp4'), self.tmp_paths, transparent=False, threads=1, window=window)
+        try:
+            for start in range(1, NUM_FRAMES + 1, segment_length):
+                end = min(start + segment_length - 1, NUM_FRAMES)
+                # once extraction is over, every extracted frame is reported
+                self.assertIn(extractor.wait_for_frames(end, start), (end, NUM_FRAMES))
+                self.assertLessEqual(self.tmp_paths.count_frame_files(), window)
+                extractor.release(start, end - start + 1)
+        except BaseException:
+            extractor.terminate()
+            raise
+        return extractor.close()
+
+    def test_window_smaller_than_video(self):
+        self.assertEqual(self.extract(window=8, segment_length=3), NUM_FRAMES)
+        self.assertEqual(self.tmp_paths.count_frame_files(), 0)
+
+    def test_segment_larger_than_window(self):
+        with self.assertRaises(FrameWindowException):
+            self.extract(window=4, segment_length=6)
+
+    def test_render_with_window_smaller_than_video(self):
+        def encode(command, callback=None, stdin=None):
+            Path(command[-1]).write_bytes(b'')
+            if callback:
+                callback()
+
+        video_path = self.folder / 'input.mp4'
+        video_path.touch()
+        args = args_util.parse_args(
+            [str(video_path), 'bounce', '--threads', '2', '--frame-transport', 'overlap', '--frame-window', '8']
+        )
+        args.cache_dir = self.folder / 'cache'
+        with mock.patch.multiple(
+            'util.ffmpeg_util',
+            get_video_info=mock.Mock(return_value=((64, 48), '30/1', None, NUM_FRAMES)),
+            split_audio=mock.Mock(return_value=False),
+            find_min_non_error_size=mock.Mock(return_value=8),
+            exec_command=encode,
+        ):
+            render = threading.Thread(
+                target=wackypywebm.wackify,
+                args=(['bounce'], video_path, args, self.folder / 'output.webm', []),
+                daemon=True,
+            )
+            render.start()
+            render.join(timeout=30)
+        self.assertFalse(render.is_alive(), 'the render waits for room in the frame window forever')
+
+    def test_failed_planning_stops_extraction(self):
+        video_path = self.folder / 'input.mp4'
+        video_path.touch()
+        args = args_util.parse_args(
+            [str(video_path), 'audiobounce', '--frame-transport', 'overlap', '--frame-window', '8']
+        )
+        args.cache_dir = self.folder / 'cache'
+        extractors = []
+
+        def record_extractor(*args, **kwargs):
+            extractors.append(FrameExtractor(*args, **kwargs))
+            return extractors[-1]
+
+        with mock.patch.multiple(
+            'util.ffmpeg_util',
+            get_video_info=mock.Mock(return_value=((64, 48), '30/1', None, NUM_FRAMES)),
+            split_audio=mock.Mock(return_value=False),
+            find_min_non_error_size=mock.Mock(return_value=8),
+        ), mock.patch('wackypywebm.FrameExtractor', side_effect=record_extractor):
+            # a silent input can't be planned with audiobounce
+            with self.assertRaises(SystemExit):
+                wackypywebm.wackify(['audiobounce'], video_path, args, self.folder / 'output.webm', [])
+        self.assertEqual(len(extractors), 1)
+        self.assertFalse(extractors[0].running)
+
+
+if __name__ == '__main__':
+    unittest.main()
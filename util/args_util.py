@@ -5,6 +5,7 @@ from pathlib import Path
 from typing import Any, Dict, Optional, Union
 
 from localization import get_locales
+from util.frame_store import FRAME_STORES, WindowedFrameStore
 
 
 class IArgs:
@@ -20,6 +21,19 @@ class IArgs:
     transparency: int
     smoothing: int
     threads: int
+    frame_transport: str
+    frame_store: str
+    frame_dir: Optional[Path]
+    frame_window: int
+    cache: bool
+    cache_dir: Optional[Path]
+    cache_size: int
+    trace: Optional[Path]
+    profile: Optional[Path]
+    resume: bool
+    work_dir: Optional[Path]
+    plan: Optional[Path]
+    plan_only: bool
 
     def __init__(self, args: Dict[str, Any]) -> None:
         for key, value in args.items():
@@ -29,7 +43,11 @@ class IArgs:
                     print('[ERROR] Incorrect path to keyframe file provided.')
                     print_help()
                     sys.exit(1)
-            elif key in ['compression', 'transparency', 'smoothing', 'threads']:
+            elif key in ['cache_dir', 'trace', 'profile', 'work_dir', 'frame_dir', 'plan'] and isinstance(
+                args[key], str
+            ):
+                args[key] = Path(value).resolve()
+            elif key in ['compression', 'transparency', 'smoothing', 'threads', 'cache_size', 'frame_window']:
                 args[key] = int(value)
             elif key in ['angle', 'tempo']:
                 args[key] = float(value)
@@ -44,11 +62,31 @@ class IArgs:
         self.smoothing = args['smoothing']
         self.threads = args['threads']
         self.output = args['output']
+        self.frame_transport = args['frame_transport']
+        self.frame_store = args['frame_store']
+        self.frame_dir = args['frame_dir']
+        self.frame_window = args['frame_window']
+        self.cache = args['cache']
+        self.cache_dir = args['cache_dir']
+        self.cache_size = args['cache_size']
+        self.trace = args['trace']
+        self.profile = args['profile']
+        self.resume = args['resume']
+        self.work_dir = args['work_dir']
+        self.plan = args['plan']
+        self.plan_only = args['plan_only']
 
 
 PARSER = argparse.ArgumentParser()
 PARSER.add_argument('file', type=Path, help='Path to file you want to be wacky.')
-PARSER.add_argument('modes', type=str, default='bounce', nargs='?', help='Modes to apply to file.')
+PARSER.add_argument(
+    'modes',
+    type=str,
+    default='bounce',
+    nargs='?',
+    help='Modes to apply to file, combined with "+". Several mode sets separated by ";" are rendered to one file each, '
+    'every set optionally followed by options of its own, e.g. "bounce;bounce -t 4;rotate -a 90".',
+)
 PARSER.add_argument(
     '-k', '--keyframes', type=Path, help='Only used with "Keyframes" mode; sets the keyframe file to use.'
 )
@@ -61,7 +99,12 @@ PARSER.add_argument(
 )
 PARSER.add_argument('-o', '--output', type=Path, help="Sets output path.")
 PARSER.add_argument(
-    '-c', '--compression', type=int, default=0, help='Sets compression level. Higher values means more compression.'
+    '-c',
+    '--compression',
+    type=int,
+    default=0,
+    help='Sets compression level. Higher values means more compression: frame sizes may be off by up to this many '
+    'pixels (width and height added up) so more frames can be encoded together.',
 )
 PARSER.add_argument('-l', '--language', type=str, default='en_us', choices=get_locales(), help='Sets language.')
 PARSER.add_argument(
@@ -72,7 +115,77 @@ PARSER.add_argument(
     help='Sets the transparency threshold for use with the "Transparency" mode.',
 )
 PARSER.add_argument('-s', '--smoothing', type=int, default=0, help='Sets the level of smoothing to apply.')
-PARSER.add_argument('--threads', type=int, default=os.cpu_count() + 4, help='Sets maximum number of threads to use.')
+PARSER.add_argument(
+    '--threads',
+    type=int,
+    default=os.cpu_count(),
+    help='Sets maximum number of threads to use. Encoder threads are shared out so their total stays within this.',
+)
+PARSER.add_argument(
+    '--frame-transport',
+    type=str,
+    choices=['png', 'overlap', 'pipe', 'seek'],
+    default='png',
+    help='Sets how decoded frames reach the encoders: "png" writes them to disk, "overlap" writes them to disk while '
+    'already encoding the segments whose frames are done, "pipe" streams raw frames in memory, "seek" has every '
+    'encoder decode its own frames from the input (no temporary frames, best for inputs that seek quickly).',
+)
+PARSER.add_argument(
+    '--frame-store',
+    type=str,
+    choices=['png', 'raw'],
+    default=os.environ.get('WACKYPYWEBM_FRAME_STORE', 'png'),
+    help='Sets how frames written to disk are stored: "png" as one compressed file per frame, "raw" uncompressed in '
+    'one file that encoders read from at each segment\'s offset (faster, but larger). Defaults to the '
+    'WACKYPYWEBM_FRAME_STORE environment variable or "png".',
+)
+PARSER.add_argument(
+    '--frame-dir',
+    type=Path,
+    default=os.environ.get('WACKYPYWEBM_FRAME_DIR'),
+    help='Sets the folder frames are written to, e.g. a RAM disk such as /dev/shm. The render stops early if the '
+    'frames could not fit there. Defaults to the WACKYPYWEBM_FRAME_DIR environment variable or the work folder.',
+)
+PARSER.add_argument(
+    '--frame-window',
+    type=int,
+    default=0,
+    help='Only used with the "overlap" frame transport; sets how many extracted frames can be on disk at once. '
+    'Extraction waits for room, and frames are removed as soon as their segment is encoded. 0 means no limit.',
+)
+PARSER.add_argument(
+    '--cache', action='store_true', help='Reuses segments encoded by previous runs instead of encoding them again.'
+)
+PARSER.add_argument('--cache-dir', type=Path, help='Sets the cache folder. Defaults to the user cache folder.')
+PARSER.add_argument(
+    '--cache-size', type=int, default=2048, help='Sets the maximum size of the segment cache in megabytes.'
+)
+PARSER.add_argument(
+    '--trace', type=Path, help='Writes a timeline of every phase and ffmpeg call, viewable in ui.perfetto.dev.'
+)
+PARSER.add_argument('--profile', type=Path, help='Writes cProfile statistics of the python side to this file.')
+PARSER.add_argument(
+    '--resume',
+    action='store_true',
+    help='Keeps the work folder of a failed render and continues it when run again, encoding only missing segments.',
+)
+PARSER.add_argument(
+    '--work-dir',
+    type=Path,
+    help='Sets the work folder, which is kept if the render fails. Defaults to a temporary folder, or the output path '
+    'with ".parts" added when resuming.',
+)
+PARSER.add_argument(
+    '--plan-only',
+    action='store_true',
+    help='Only probes the video and plans its segments, without extracting or encoding anything. Writes the plan '
+    'and an estimate of what rendering it costs to the --plan file, or next to the output with ".plan.json".',
+)
+PARSER.add_argument(
+    '--plan',
+    type=Path,
+    help='Renders from a plan written by --plan-only for the same video and options instead of planning again.',
+)
 
 
 def get_arg_desc(dest):
@@ -82,8 +195,18 @@ def get_arg_desc(dest):
     return 'NOT_FOUND'
 
 
-def parse_args(*args) -> IArgs:
-    return PARSER.parse_args(*args)
+def parse_args(*args, namespace: Optional[Any] = None) -> IArgs:
+    """Options missing from the arguments keep their value in `namespace`, if one is given."""
+    parsed = PARSER.parse_args(*args, namespace=namespace)
+    if (
+        parsed.frame_window
+        and parsed.frame_transport == 'overlap'
+        and not issubclass(FRAME_STORES[parsed.frame_store], WindowedFrameStore)
+    ):
+        PARSER.error(
+            f'--frame-window can\'t be used with the "{parsed.frame_store}" frame store, it can\'t remove frames.'
+        )
+    return parsed
 
 
 def print_help():
@@ -0,0 +1,55 @@
+import hashlib
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+import localization
+import util.ffmpeg_util as ffmpeg_util
+from util.cache_util import get_cache_dir, get_file_digest
+
+# bump whenever the analysis changes, so levels persisted by older versions are not reused
+_ANALYSIS_VERSION = 'pcm-rms-per-frame-1'
+
+
+class AudioLevels:
+    """Normalized per-frame audio levels, computed once per source and shared by every mode and run."""
+
+    levels: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def get(cls, video_path: Path, fps: float, cache_dir: Optional[Path] = None) -> np.ndarray:
+        cache_dir = get_cache_dir(cache_dir)
+        key = hashlib.sha256(
+            f'{get_file_digest(video_path, cache_dir)}:{fps!r}:{_ANALYSIS_VERSION}'.encode()
+        ).hexdigest()
+        if key in cls.levels:
+            return cls.levels[key]
+
+        levels_path = cache_dir / 'audio_levels' / f'{key}.npy'
+        if levels_path.is_file():
+            cls.levels[key] = np.load(levels_path)
+            return cls.levels[key]
+
+        cls.levels[key] = normalize_audio_levels(ffmpeg_util.get_frames_audio_dbs(video_path, fps))
+        levels_path.parent.mkdir(exist_ok=True)
+        tmp_path = levels_path.with_suffix('.tmp.npy')
+        np.save(tmp_path, cls.levels[key])
+        tmp_path.replace(levels_path)
+        return cls.levels[key]
+
+
+def normalize_audio_levels(dbs: np.ndarray) -> np.ndarray:
+    """Maps RMS levels in dB to 0..1, with the average level at 0.5 and the loudest level clamped to 1."""
+    if len(dbs) == 0 or dbs.max() == float('-inf'):
+        localization.print('no_audio')
+        sys.exit(1)
+
+    average = np.where(np.isneginf(dbs), 0, dbs).sum() / len(dbs)
+    deviation = abs((dbs.max() - average) / 2)
+    if deviation == 0:
+        return np.full(len(dbs), 0.5, dtype=np.float32)
+
+    clamped = np.maximum(np.minimum(dbs, average + deviation), average - deviation)
+    return (0.5 + (clamped - average) / deviation * 0.5).astype(np.float32)
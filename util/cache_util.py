@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+_HASH_CHUNK_SIZE = 1024 * 1024  # 1Mb
+# renders running as threads of one process (batches, the server) share the cache's json tables, reading one and
+# writing it back has to happen under this lock so no render's entries get lost
+TABLES_LOCK = threading.Lock()
+
+
+def get_cache_dir(cache_dir: Optional[Path] = None) -> Path:
+    if cache_dir is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or (os.environ.get('LOCALAPPDATA') if os.name == 'nt' else None)
+        cache_dir = (Path(cache_home) if cache_home else Path.home() / '.cache') / 'wackypywebm'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def read_json(path: Path) -> Dict[str, Any]:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json(path: Path, data: Dict[str, Any]):
+    # write to a sibling file first so concurrent readers never see half a file, unique per write so concurrent
+    # writers never share one
+    fd, tmp_name = tempfile.mkstemp(prefix=f'{path.name}.', suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(json.dumps(data))
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def get_file_digest(path: Path, cache_dir: Optional[Path] = None) -> str:
+    """sha256 of the file's content, remembered per (path, size, mtime) so unchanged files are hashed only once."""
+    digests_path = get_cache_dir(cache_dir) / 'digests.json'
+    stat = path.stat()
+    stamp = [stat.st_size, stat.st_mtime_ns]
+
+    digests = read_json(digests_path)
+    entry = digests.get(str(path))
+    if entry and entry['stamp'] == stamp:
+        return entry['digest']
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+
+    with TABLES_LOCK:
+        digests = read_json(digests_path)  # re-read, another run may have added entries meanwhile
+        digests[str(path)] = {'stamp': stamp, 'digest': sha256.hexdigest()}
+        write_json(digests_path, digests)
+    return sha256.hexdigest()
+
+
+def link_or_copy(source: Path, destination: Path):
+    try:
+        os.link(source, destination)
+    except OSError:
+        # different file systems or no hard link support
+        shutil.copyfile(source, destination)
@@ -4,18 +4,23 @@ import os
 import re
 import subprocess
 import sys
+import tempfile
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import numpy as np
+
 import localization
-from modes.mode_base import FrameAudioLevel
+import util.trace as trace
+from util.cache_util import TABLES_LOCK, get_cache_dir, read_json, write_json
 from util.tmp_paths import TmpPaths
 
 _MAX_BUFFER_SIZE = 1024 * 1000 * 8  # 8Mb
+_AUDIO_CHUNK_SAMPLES = 1024 * 1024  # per channel, 4Mb of mono float samples
 
 
-class FFMPEGExcption(Exception):
-    ...
+class FFMPEGExcption(Exception): ...
 
 
 def ffmpeg_error_handler(stderr: bytes):
@@ -46,18 +51,10 @@ def get_valid_path(path: Path, _filter=False) -> str:
     return str(path)
 
 
-def get_video_info(video_path: Path) -> Tuple[Tuple[int, int], str, Optional[int], int]:
+def _probe(video_path: Path, *options: str, stream: str = 'v:0') -> Dict[str, Any]:
     try:
-        video_data = subprocess.run(
-            # fmt:off
-            [
-                'ffprobe', '-v', 'error',
-                '-select_streams', 'v', '-of', 'json',
-                '-count_frames', '-show_entries',
-                'stream=r_frame_rate,width,height,nb_read_frames,bit_rate',
-                video_path,
-            ],
-            # fmt:on
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', stream, '-of', 'json', *options, video_path],
             bufsize=_MAX_BUFFER_SIZE,
             capture_output=True,
             check=True,
@@ -65,22 +62,67 @@ def get_video_info(video_path: Path) -> Tuple[Tuple[int, int], str, Optional[int
     except subprocess.CalledProcessError as error:
         ffmpeg_error_handler(error.stderr)
 
-    stream_data: Dict[str, Any] = json.loads(video_data.stdout)['streams'][0]  # type: ignore
+    return json.loads(out.stdout)  # type: ignore
+
+
+def estimate_frame_count(stream_data: Dict[str, Any], format_data: Dict[str, Any], exact: bool) -> Optional[int]:
+    """Frame count from container metadata, or None if the metadata can't be trusted."""
+    duration = stream_data.get('duration') or format_data.get('duration')
+    avg_frame_rate = stream_data.get('avg_frame_rate', '0/0')
+    expected: Optional[float] = None
+    if duration and avg_frame_rate not in ('0/0', '0'):
+        expected = float(duration) * parse_fps(avg_frame_rate)
+
+    # the container's own frame count, as long as it roughly agrees with the duration (edit lists can cut frames)
+    nb_frames = int(stream_data.get('nb_frames') or 0)
+    if nb_frames > 0 and (expected is None or abs(nb_frames - expected) <= max(2, expected * 0.01)):
+        return nb_frames
+
+    # duration * frame rate is only right for constant frame rate videos, and even then may be a frame off
+    if not exact and expected is not None and stream_data['r_frame_rate'] == avg_frame_rate:
+        return max(1, round(expected))
+
+    return None
+
+
+def count_packets(video_path: Path) -> int:
+    # demuxes the whole file but decodes nothing, one packet per frame for all codecs ffmpeg can write to webm
+    stream_data = _probe(video_path, '-count_packets', '-show_entries', 'stream=nb_read_packets')['streams'][0]
+    return int(stream_data['nb_read_packets'])
+
+
+def has_audio_stream(video_path: Path) -> bool:
+    return bool(_probe(video_path, '-show_entries', 'stream=index', stream='a:0').get('streams'))
+
+
+def get_video_info(
+    video_path: Path, exact_frame_count: bool = False
+) -> Tuple[Tuple[int, int], str, Optional[int], int]:
+    probe_data = _probe(
+        video_path,
+        '-show_entries',
+        'stream=r_frame_rate,avg_frame_rate,width,height,nb_frames,duration,bit_rate:format=duration',
+    )
+    stream_data: Dict[str, Any] = probe_data['streams'][0]
+    num_frames = estimate_frame_count(stream_data, probe_data.get('format', {}), exact_frame_count)
+    if num_frames is None:
+        num_frames = count_packets(video_path)
+
     return (
         (stream_data['width'], stream_data['height']),
         stream_data['r_frame_rate'],
         int(stream_data['bit_rate']) if stream_data.get('bit_rate') else None,
-        int(stream_data['nb_read_frames']),
+        num_frames,
     )
 
 
-def split_audio(video_path: Path) -> bool:
+def split_audio(video_path: Path, tmp_paths: TmpPaths) -> bool:
     try:
         out = subprocess.run(
             # fmt:off
             [
                 'ffmpeg', '-y', '-i', video_path,
-                '-vn', '-c:a', 'libvorbis', TmpPaths.tmp_audio,
+                '-vn', '-c:a', 'libvorbis', tmp_paths.tmp_audio,
             ],
             # fmt:on
             bufsize=_MAX_BUFFER_SIZE,
@@ -94,77 +136,155 @@ def split_audio(video_path: Path) -> bool:
     return True
 
 
-def split_frames(video_path: Path, transparent: bool, threads: int):
+def has_constant_frame_rate(video_path: Path) -> bool:
+    # frames are only where their index says when the stream's timing matches its nominal frame rate
+    stream_data = _probe(video_path, '-show_entries', 'stream=r_frame_rate,avg_frame_rate')['streams'][0]
+    return stream_data['r_frame_rate'] == stream_data['avg_frame_rate']
+
+
+def get_first_frame_time(stderr: bytes) -> Optional[float]:
+    """Timestamp in seconds of the first frame logged by a showinfo filter."""
+    match = re.search(rb'\bn:\s*0\s.*?\bpts_time:\s*(\S+)', stderr)
+    return float(match.group(1)) if match else None
+
+
+def seek_input_args(video_path: Path, start: int, fps: str, transparent: bool) -> List[Any]:
+    """Input arguments decoding `video_path` from frame `start` (1-based) on, without any frames before it."""
+    command: List[Any] = ['-vcodec', 'libvpx'] if transparent else []
+    if start > 1:
+        # accurate seeking drops every frame before the given time, which sits half a frame ahead of the first frame
+        # wanted so rounding can't drop it too; timestamps of the output start at 0 again
+        command += ['-ss', f'{(start - 1.5) / parse_fps(fps):.6f}']
+    # only the video, audio is added when concatenating
+    return command + ['-i', video_path, '-map', '0:v:0']
+
+
+def split_frames_command(
+    video_path: Path, tmp_paths: TmpPaths, transparent: bool, threads: int, piped: bool = False
+) -> List[Any]:
     command = ['ffmpeg', '-threads', f'{threads}', '-y']
     if transparent:
         command += ['-vcodec', 'libvpx']
-    command += ['-i', video_path, '-q:v', '0', TmpPaths.tmp_frame_files]
+    frame_store = tmp_paths.frame_store
+    output_args = frame_store.pipe_output_args() if piped else frame_store.output_args()  # type: ignore
+    return command + ['-i', video_path, *output_args]
+
 
+def split_frames(video_path: Path, tmp_paths: TmpPaths, transparent: bool, threads: int) -> int:
+    command = split_frames_command(video_path, tmp_paths, transparent, threads)
     try:
         out = subprocess.run(command, bufsize=_MAX_BUFFER_SIZE, capture_output=True, check=True)
     except subprocess.CalledProcessError as error:
         ffmpeg_error_handler(error.stderr)
 
+    # the exact number of frames, for free
+    return tmp_paths.count_frame_files()
 
-def exec_command(command: List[str], callback: Optional[Callable[[], None]] = None):
-    try:
-        out = subprocess.run(command, bufsize=_MAX_BUFFER_SIZE, capture_output=True, check=True)
-    except subprocess.CalledProcessError as error:
-        ffmpeg_error_handler(error.stderr)
+
+def exec_command(
+    command: List[str], callback: Optional[Callable[[], None]] = None, stdin: Optional[bytes] = None
+) -> bytes:
+    with trace.span(f'ffmpeg {Path(command[-1]).name}', 'subprocess', **_command_trace_args(command)) as span_args:
+        try:
+            out = subprocess.run(command, bufsize=_MAX_BUFFER_SIZE, input=stdin, capture_output=True, check=True)
+        except subprocess.CalledProcessError as error:
+            span_args['exit_status'] = error.returncode
+            ffmpeg_error_handler(error.stderr)
+        span_args['exit_status'] = out.returncode
 
     if callback:
         callback()
+    return out.stderr
 
 
-def get_frames_audio_levels(video_path: Path):
-    try:
-        out = subprocess.run(
-            # fmt:off
-            [
-                'ffprobe', '-f', 'lavfi',
-                '-i', f'amovie={get_valid_path(video_path, _filter=True)},astats=metadata=1:reset=1',
-                '-show_entries', 'frame=pkt_pts_time:frame_tags=lavfi.astats.Overall.RMS_level',
-                '-of', 'json',
-            ],
-            # fmt:on
-            bufsize=_MAX_BUFFER_SIZE,
-            capture_output=True,
-            check=True,
-        )
-    except subprocess.CalledProcessError as error:
-        ffmpeg_error_handler(error.stderr)
-
-    highest: Optional[float] = None
-    frames_audio_levels: List[FrameAudioLevel] = []
-    dbs_sum = 0
-    for frame_dbs in json.loads(out.stdout)['frames']:  # type: ignore
-        fal = FrameAudioLevel(frame_dbs)
-        frames_audio_levels.append(fal)
-
-        if highest is None:
-            highest = fal.dbs
-        else:
-            if fal.dbs > highest:
-                highest = fal.dbs
+def _command_trace_args(command: List[Any]) -> Dict[str, Any]:
+    options = {'-frames:v': 'frames', '-threads': 'threads'}
+    return {options[str(option)]: int(value) for option, value in zip(command, command[1:]) if str(option) in options}
 
-        dbs_sum += fal.dbs if fal.dbs != float('-inf') else 0
 
-    if highest is None or highest == float('-inf'):
+def get_frames_audio_dbs(video_path: Path, fps: float) -> np.ndarray:
+    """RMS level in dB of the audio under every video frame, computed from raw samples streamed in fixed-size chunks."""
+    streams = _probe(video_path, '-show_entries', 'stream=sample_rate,channels', stream='a:0')['streams']
+    if not streams:
         localization.print('no_audio')
         sys.exit(1)
-
-    average = dbs_sum / len(frames_audio_levels)
-    deviation = abs((highest - average) / 2)
-
-    for fal in frames_audio_levels:
-        clamped = max(min(fal.dbs, (average + deviation)), (average - deviation))
-        v = abs((clamped - average) / deviation) * 0.5
-        fal.percent_max = (0.5 + v) if clamped > average else (0.5 - v)
-
-    return frames_audio_levels
-
-
-def find_min_non_error_size(width: int, height: int) -> int:
+    sample_rate, channels = int(streams[0]['sample_rate']), int(streams[0]['channels'])
+    samples_per_frame = sample_rate / fps
+
+    stderr = tempfile.TemporaryFile()
+    # fmt:off
+    process = subprocess.Popen(
+        [
+            'ffmpeg', '-v', 'error', '-nostats', '-i', video_path,
+            '-map', '0:a:0', '-f', 'f32le', '-acodec', 'pcm_f32le', '-',
+        ],
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+    )
+    # fmt:on
+
+    window_sums: List[np.ndarray] = []
+    window_lengths: List[np.ndarray] = []
+    carried_sum, carried_length = 0.0, 0  # the window that is still open at the end of the previous chunk
+    position = 0  # index of the first sample of the current chunk
+    next_window = 1
+    while chunk := process.stdout.read(_AUDIO_CHUNK_SAMPLES * channels * 4):  # type: ignore
+        samples = np.frombuffer(chunk[: len(chunk) - len(chunk) % (channels * 4)], dtype='<f4')
+        # mean square over all channels, like astats' "Overall" values
+        squares = np.square(samples.reshape(-1, channels), dtype=np.float64).mean(axis=1)
+        cumulative = np.concatenate(([0.0], np.cumsum(squares)))
+
+        # windows are closed at sample floor(k * samples_per_frame)
+        last_window = int((position + len(squares)) // samples_per_frame)
+        ends = (np.floor(np.arange(next_window, last_window + 1) * samples_per_frame) - position).astype(np.int64)
+        ends = ends[ends <= len(squares)]
+        if len(ends):
+            edges = np.concatenate(([0], ends))
+            sums, lengths = np.diff(cumulative[edges]), np.diff(edges)
+            sums[0] += carried_sum
+            lengths[0] += carried_length
+            window_sums.append(sums)
+            window_lengths.append(lengths)
+            next_window += len(ends)
+            carried_sum, carried_length = cumulative[-1] - cumulative[ends[-1]], len(squares) - int(ends[-1])
+        else:
+            carried_sum, carried_length = carried_sum + cumulative[-1], carried_length + len(squares)
+        position += len(squares)
+
+    process.stdout.close()  # type: ignore
+    process.wait()
+    stderr.seek(0)
+    if process.returncode != 0:
+        ffmpeg_error_handler(stderr.read())
+    stderr.close()
+
+    if carried_length:
+        window_sums.append(np.array([carried_sum]))
+        window_lengths.append(np.array([carried_length]))
+    if not window_sums:
+        return np.empty(0)
+
+    mean_squares = np.concatenate(window_sums) / np.maximum(np.concatenate(window_lengths), 1)
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(mean_squares)  # 20 * log10(rms), silence becomes -inf
+
+
+@lru_cache(maxsize=None)
+def find_min_non_error_size(width: int, height: int, cache_dir: Optional[Path] = None) -> int:
+    # the answer only depends on the resolution, so it is kept in a table that grows with every new resolution
+    table_path = get_cache_dir(cache_dir) / 'min_sizes.json'
+    key = f'{width}x{height}'
+    min_size = read_json(table_path).get(key)
+    if min_size is None:
+        min_size = _find_min_non_error_size(width, height)
+        with TABLES_LOCK:
+            table = read_json(table_path)
+            table[key] = min_size
+            write_json(table_path, table)
+    return min_size
+
+
+def _find_min_non_error_size(width: int, height: int) -> int:
     def av_reduce_succeeds(num, den):
         MAX = 255
         a0 = [0, 1]
@@ -199,7 +319,8 @@ def find_min_non_error_size(width: int, height: int) -> int:
             num = den
             den = next_den
 
-        return math.gcd(a1[0], a1[1]) <= 1 and (a1[0] <= MAX and a1[1] <= MAX) and a1[0] > 0 and a1[1] > 0
+        # convergents of a continued fraction are always coprime, no need to check the gcd again
+        return 0 < a1[0] <= MAX and 0 < a1[1] <= MAX
 
     for i in range(1, max(width, height)):
         if av_reduce_succeeds(i, height) and av_reduce_succeeds(width, i):
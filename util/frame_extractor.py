@@ -0,0 +1,158 @@
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+
+import util.ffmpeg_util as ffmpeg_util
+import util.trace as trace
+from localization import localize_str
+from util.frame_store import WindowedFrameStore
+from util.tmp_paths import TmpPaths
+
+
+class FrameWindowException(Exception): ...
+
+
+class FrameExtractor:
+    """Extracts frames to the frame store in the background, keeping count of how many are already on disk.
+
+    ffmpeg's `-progress` report says when new frames came out, but it can run ahead of the muxer, so a frame only
+    counts as done once writing the frame after it has been started.
+
+    With a `window`, frames come through a pipe and are written here instead, and no more than `window` of them are
+    on disk at once: extraction waits until frames are `release`d once their segment is encoded.
+    """
+
+    __slots__ = (
+        'tmp_paths',
+        'window',
+        'process',
+        'stderr',
+        'frames_done',
+        'frames_released',
+        'finished',
+        'stopping',
+        'condition',
+        'thread',
+    )
+
+    def __init__(self, video_path: Path, tmp_paths: TmpPaths, transparent: bool, threads: int, window: int = 0) -> None:
+        self.tmp_paths = tmp_paths
+        self.window = window
+        self.frames_done = 0
+        self.frames_released = 0
+        self.finished = False
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.stderr = tempfile.TemporaryFile()
+
+        command = ffmpeg_util.split_frames_command(video_path, tmp_paths, transparent, threads, piped=bool(window))
+        command[1:1] = ['-v', 'error', '-nostats'] if window else ['-v', 'error', '-nostats', '-progress', 'pipe:1']
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self.stderr)
+        self.thread = threading.Thread(target=self._write_frames if window else self._read_progress, daemon=True)
+        self.thread.start()
+
+    def _read_progress(self):
+        start_time = trace.now()
+        for line in self.process.stdout:  # type: ignore
+            key, _, value = line.decode().strip().partition('=')
+            if key == 'frame' and value.isdecimal():
+                with self.condition:
+                    self.frames_done = int(value)
+                    self.condition.notify_all()
+        self._finish(start_time)
+
+    def _write_frames(self):
+        start_time = trace.now()
+        frame_store: WindowedFrameStore = self.tmp_paths.frame_store  # type: ignore  # see args_util.parse_args
+        while True:
+            with self.condition:
+                # a full window holds ffmpeg back, as its output pipe fills up while this waits
+                self.condition.wait_for(lambda: self.stopping or self.frames_done - self.frames_released < self.window)
+            frame = frame_store.read_piped_frame(self.process.stdout)  # type: ignore
+            if frame is None:
+                break
+            if self.stopping:
+                continue  # nobody needs the rest, only let ffmpeg finish
+            frame_store.write_frame(self.frames_done + 1, frame)
+            with self.condition:
+                self.frames_done += 1
+                self.condition.notify_all()
+        self._finish(start_time)
+
+    def _finish(self, start_time: float):
+        self.process.wait()
+        with self.condition:
+            if self.process.returncode == 0 and not self.window:
+                # the exact number of frames, the progress report can end before the last one
+                self.frames_done = self.tmp_paths.count_frame_files()
+            self.finished = True
+            self.condition.notify_all()
+        trace.add_span('frame_split', 'phase', start_time, trace.now(), {'frames': self.frames_done})
+
+    def wait_for_frames(self, count: int, start: int = 1) -> int:
+        """Waits until frames `start` to `count` are on disk or extraction is over, and returns how many there are,
+        or 0 once stopped.
+
+        With a window, the frames before `start` have to be released eventually to make room; if they all are and
+        the window is still too small for the rest, this raises instead of waiting forever.
+        """
+        frame_store = self.tmp_paths.frame_store
+        with self.condition:
+            while not self.finished and not (
+                self.frames_done >= count
+                if self.window
+                else self.frames_done > count and frame_store.has_frame(count + 1)
+            ):
+                if self.stopping:
+                    return 0
+                if self.window and self.frames_released >= start - 1 and count - self.frames_released > self.window:
+                    raise FrameWindowException(
+                        localize_str(
+                            'frame_window_too_small', args={'window': self.window, 'frames': count - start + 1}
+                        )
+                    )
+                self.condition.wait(0.1)
+            if self.finished:
+                self._check_error()
+                return self.frames_done
+            return count
+
+    def release(self, start: int, frame_count: int):
+        """Removes frames that are no longer needed, making room in the window for new ones."""
+        if not self.window:
+            return
+        self.tmp_paths.frame_store.remove_frames(start, frame_count)  # type: ignore
+        with self.condition:
+            self.frames_released += frame_count
+            self.condition.notify_all()
+
+    def stop(self):
+        """Stops waiting for frames, e.g. when an encode failed and will never release its frames."""
+        with self.condition:
+            # frames past the planned ones would wait for room forever
+            self.stopping = True
+            self.condition.notify_all()
+
+    def close(self) -> int:
+        """Waits for extraction to finish and returns the number of extracted frames."""
+        self.stop()
+        self.thread.join()
+        self._check_error()
+        self.stderr.close()
+        return self.frames_done
+
+    @property
+    def running(self) -> bool:
+        return self.process.poll() is None or self.thread.is_alive()
+
+    def terminate(self):
+        self.process.kill()
+        self.stop()
+        self.thread.join()
+        self.stderr.close()
+
+    def _check_error(self):
+        if self.process.returncode != 0:
+            self.stderr.seek(0)
+            ffmpeg_util.ffmpeg_error_handler(self.stderr.read())
@@ -0,0 +1,79 @@
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import List
+
+import util.ffmpeg_util as ffmpeg_util
+
+# raw frames read ahead for the encoders stay around this size, however long the video is
+MAX_BUFFERED_BYTES = 1024 * 1024 * 1024
+
+
+class FramePipe:
+    """Decodes the input video once into raw frames which are read in order from ffmpeg's stdout.
+
+    A segment's frames are read whole before its encoder starts, so segments have to be planned short enough for
+    `get_frame_window` frames to cover one per encoder thread.
+    """
+
+    __slots__ = ('width', 'height', 'pix_fmt', 'frame_size', 'process', 'stderr')
+
+    def __init__(self, video_path: Path, width: int, height: int, transparent: bool, threads: int) -> None:
+        self.width = width
+        self.height = height
+        # same pixel formats the png encoder would have picked, so both transports produce identical segments
+        self.pix_fmt = 'rgba' if transparent else 'rgb24'
+        self.frame_size = get_frame_size(width, height, transparent)
+        self.stderr = tempfile.TemporaryFile()
+
+        command = ['ffmpeg', '-threads', f'{threads}', '-v', 'error', '-nostats']
+        if transparent:
+            command += ['-vcodec', 'libvpx']
+        # fmt:off
+        command += [
+            '-i', video_path,
+            '-f', 'rawvideo', '-pix_fmt', self.pix_fmt, '-',
+        ]
+        # fmt:on
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self.stderr)
+
+    @staticmethod
+    def get_frame_window(width: int, height: int, transparent: bool) -> int:
+        """How many raw frames fit in `MAX_BUFFERED_BYTES`."""
+        return max(1, MAX_BUFFERED_BYTES // get_frame_size(width, height, transparent))
+
+    def input_args(self, fps: str) -> List[str]:
+        # fmt:off
+        return [
+            '-f', 'rawvideo', '-pix_fmt', self.pix_fmt,
+            '-s', f'{self.width}x{self.height}', '-r', fps,
+            '-i', '-',
+        ]
+        # fmt:on
+
+    def read_frames(self, count: int) -> bytes:
+        frames = self.process.stdout.read(count * self.frame_size)  # type: ignore
+        # a truncated last frame is of no use to the encoder
+        return frames[: len(frames) - len(frames) % self.frame_size]
+
+    def close(self):
+        # drain whatever is left so the decoder does not die on a broken pipe
+        while self.process.stdout.read(self.frame_size):  # type: ignore
+            pass
+        self.process.stdout.close()  # type: ignore
+        self.process.wait()
+
+        self.stderr.seek(0)
+        stderr = self.stderr.read()
+        self.stderr.close()
+        if self.process.returncode != 0:
+            ffmpeg_util.ffmpeg_error_handler(stderr)
+
+    def terminate(self):
+        self.process.kill()
+        self.process.wait()
+        self.stderr.close()
+
+
+def get_frame_size(width: int, height: int, transparent: bool) -> int:
+    return width * height * (4 if transparent else 3)
@@ -0,0 +1,187 @@
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional, Type
+
+from localization import localize_str
+
+
+class FrameStoreFullException(Exception): ...
+
+
+class FrameStore(ABC):
+    """Where extracted frames are written to and how segment encoders read them back.
+
+    With `check_capacity`, frames are only extracted once it is sure they fit, e.g. in a RAM backed folder.
+    """
+
+    __slots__ = ('folder', 'transparent', 'check_capacity', 'width', 'height')
+    # whether frames can only be counted and read once the frame size is known
+    sized = False
+
+    def __init__(self, folder: Path, transparent: bool, check_capacity: bool = False) -> None:
+        self.folder = folder
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.transparent = transparent
+        self.check_capacity = check_capacity
+        self.width = 0
+        self.height = 0
+
+    @property
+    def pix_fmt(self) -> str:
+        # same pixel formats the png encoder picks
+        return 'rgba' if self.transparent else 'rgb24'
+
+    @property
+    def frame_size(self) -> int:
+        return self.width * self.height * (4 if self.transparent else 3)
+
+    def prepare(self, width: int, height: int, num_frames: int):
+        """Sets the frame size once the input is probed, and makes sure `num_frames` frames fit if asked to, which is
+        the most that are on disk at once."""
+        self.width = width
+        self.height = height
+        if not self.check_capacity:
+            return
+        # raw frames, which is also the most a png of them takes
+        needed = num_frames * self.frame_size
+        free = shutil.disk_usage(self.folder).free
+        if needed > free:
+            raise FrameStoreFullException(
+                localize_str(
+                    'frame_store_full',
+                    args={'path': self.folder, 'needed': needed // 1024**2, 'free': free // 1024**2},
+                )
+            )
+
+    @abstractmethod
+    def output_args(self) -> List[Any]:
+        """ffmpeg output arguments that write the frames."""
+
+    @abstractmethod
+    def input_args(self, start: int, fps: str) -> List[Any]:
+        """ffmpeg input arguments that read the frames from frame `start` (1-based) on."""
+
+    @abstractmethod
+    def count_frames(self) -> int:
+        pass
+
+    @abstractmethod
+    def has_frame(self, index: int) -> bool:
+        """Whether writing frame `index` (1-based) has started."""
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.folder.mkdir(parents=True)
+
+
+class WindowedFrameStore(FrameStore):
+    """Frame store whose frames can be written one by one and removed again, see FrameExtractor's window."""
+
+    __slots__ = ()
+
+    @abstractmethod
+    def pipe_output_args(self) -> List[Any]:
+        """ffmpeg output arguments that send the frames to stdout, to be stored by `write_frame`."""
+
+    @abstractmethod
+    def read_piped_frame(self, stream: IO[bytes]) -> Optional[bytes]:
+        """Reads the next frame sent by `pipe_output_args`, None once there are no more."""
+
+    @abstractmethod
+    def write_frame(self, index: int, frame: bytes):
+        pass
+
+    @abstractmethod
+    def remove_frames(self, start: int, frame_count: int):
+        pass
+
+
+class PngFrameStore(WindowedFrameStore):
+    """One png file per frame."""
+
+    __slots__ = ()
+
+    def output_args(self) -> List[Any]:
+        return ['-q:v', '0', self.folder / '%05d.png']
+
+    def input_args(self, start: int, fps: str) -> List[Any]:
+        # fmt:off
+        return [
+            '-r', fps,
+            '-start_number', str(start),
+            '-i', self.folder / '%05d.png',
+        ]
+        # fmt:on
+
+    def count_frames(self) -> int:
+        return sum(1 for _ in self.folder.glob('*.png'))
+
+    def has_frame(self, index: int) -> bool:
+        return (self.folder / f'{index:05d}.png').exists()
+
+    def pipe_output_args(self) -> List[Any]:
+        return ['-f', 'image2pipe', '-c:v', 'png', '-']
+
+    def read_piped_frame(self, stream: IO[bytes]) -> Optional[bytes]:
+        # the signature, then chunks of length, type, data and checksum up to the IEND chunk
+        chunks = [stream.read(8)]
+        if len(chunks[0]) < 8:
+            return None
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                return None
+            chunks += [header, stream.read(int.from_bytes(header[:4], 'big') + 4)]
+            if header[4:] == b'IEND':
+                return b''.join(chunks)
+
+    def write_frame(self, index: int, frame: bytes):
+        (self.folder / f'{index:05d}.png').write_bytes(frame)
+
+    def remove_frames(self, start: int, frame_count: int):
+        for index in range(start, start + frame_count):
+            (self.folder / f'{index:05d}.png').unlink(missing_ok=True)
+
+
+class RawFrameStore(FrameStore):
+    """All frames uncompressed in one file, every frame taking the same number of bytes.
+
+    Nothing is spent on png compression, and encoders start reading right at their first frame's offset, which for
+    recently written frames is still in the page cache.
+    """
+
+    __slots__ = ()
+    sized = True
+
+    @property
+    def path(self) -> Path:
+        return self.folder / 'frames.raw'
+
+    def output_args(self) -> List[Any]:
+        return ['-f', 'rawvideo', '-pix_fmt', self.pix_fmt, self.path]
+
+    def input_args(self, start: int, fps: str) -> List[Any]:
+        # fmt:off
+        return [
+            '-f', 'rawvideo', '-pix_fmt', self.pix_fmt,
+            '-s', f'{self.width}x{self.height}', '-r', fps,
+            '-skip_initial_bytes', str((start - 1) * self.frame_size),
+            '-i', self.path,
+        ]
+        # fmt:on
+
+    def count_frames(self) -> int:
+        try:
+            return self.path.stat().st_size // self.frame_size
+        except (OSError, ZeroDivisionError):
+            return 0
+
+    def has_frame(self, index: int) -> bool:
+        try:
+            return self.path.stat().st_size > (index - 1) * self.frame_size
+        except OSError:
+            return False
+
+
+FRAME_STORES: Dict[str, Type[FrameStore]] = {'png': PngFrameStore, 'raw': RawFrameStore}
@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import localization
+
+
+class ProgressEvent:
+    __slots__ = ('start_frame', 'frame_count', 'frames_done', 'total_frames')
+
+    def __init__(self, start_frame: int, frame_count: int, frames_done: int, total_frames: int) -> None:
+        self.start_frame = start_frame  # first frame of the segment that finished last
+        self.frame_count = frame_count
+        self.frames_done = frames_done
+        self.total_frames = total_frames
+
+    @property
+    def end_frame(self) -> int:
+        return self.start_frame + self.frame_count - 1
+
+    @property
+    def percent(self) -> float:
+        return 100 * self.frames_done / self.total_frames if self.total_frames else 100.0
+
+
+ProgressSubscriber = Callable[[ProgressEvent], None]
+
+
+class ProgressTracker:
+    """Counts finished frames and notifies subscribers from its own thread.
+
+    Workers only put finished segments on a queue. Subscribers are called at most every `min_interval` seconds,
+    with the latest state, and always once all frames are done.
+    """
+
+    __slots__ = ('total_frames', 'min_interval', 'subscribers', 'frames_done', 'queue', 'thread')
+
+    def __init__(self, total_frames: int, min_interval: float = 0.1) -> None:
+        self.total_frames = total_frames
+        self.min_interval = min_interval
+        self.subscribers: List[ProgressSubscriber] = []
+        self.frames_done = 0
+        self.queue: 'queue.Queue[Optional[Tuple[int, int]]]' = queue.Queue()
+        self.thread = threading.Thread(target=self._report, daemon=True)
+
+    def subscribe(self, subscriber: ProgressSubscriber):
+        self.subscribers.append(subscriber)
+
+    def start(self):
+        self.thread.start()
+
+    def update(self, start_frame: int, frame_count: int):
+        self.queue.put((start_frame, frame_count))
+
+    def finish(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _report(self):
+        last_notified = 0.0
+        unreported: Optional[ProgressEvent] = None
+        while True:
+            try:
+                item = self.queue.get(timeout=self.min_interval if unreported else None)
+            except queue.Empty:
+                pass  # nothing new for a while, flush what is pending
+            else:
+                if item is None:
+                    break
+                start_frame, frame_count = item
+                self.frames_done += frame_count
+                unreported = ProgressEvent(start_frame, frame_count, self.frames_done, self.total_frames)
+
+            now = time.monotonic()
+            if unreported and (now - last_notified >= self.min_interval or self.frames_done >= self.total_frames):
+                self._notify(unreported)
+                last_notified, unreported = now, None
+
+        if unreported:
+            self._notify(unreported)
+
+    def _notify(self, event: ProgressEvent):
+        for subscriber in self.subscribers:
+            subscriber(event)
+
+
+def print_progress_bar(event: ProgressEvent):
+    localization.progress_bar_print(
+        'convert_progress',
+        args={
+            'framecount': f'{event.frame_count:>5}',
+            'startframe': event.start_frame,
+            'endframe': event.end_frame,
+            'batch_size': event.total_frames,
+            'percent': f'{event.percent:.1f}',
+        },
+    )
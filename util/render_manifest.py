@@ -0,0 +1,104 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import util.ffmpeg_util as ffmpeg_util
+from segment_plan import Segment, SegmentPlan
+from util.cache_util import read_json, write_json
+
+
+class RenderManifest:
+    """Plan and finished segments of a render, kept in its work folder so a failed render can pick up where it was.
+
+    The plan is written to `path` once, finished segments are appended to `completed_path` one line each as
+    "<name> <size>", so marking one done doesn't rewrite everything before it.
+
+    With `load`, what an earlier run with the same `settings` wrote is picked up, anything else starts over.
+    """
+
+    __slots__ = ('path', 'completed_path', 'settings', 'plan', 'frames', 'completed', 'lock')
+
+    def __init__(self, path: Path, completed_path: Path, settings: Dict[str, Any], load: bool = True) -> None:
+        self.path = path
+        self.completed_path = completed_path
+        self.settings = settings
+        self.plan: Optional[SegmentPlan] = None
+        self.frames: Optional[int] = None  # number of frames already extracted to disk
+        self.completed: Dict[str, int] = {}  # segment name to the size of its finished file
+        self.lock = threading.Lock()
+
+        data = read_json(path) if load else {}
+        if data.get('settings') == settings and data.get('plan'):
+            self.plan = SegmentPlan.from_dict(data['plan'])
+            self.frames = data.get('frames')
+            self.completed = self._read_completed()
+
+    def _read_completed(self) -> Dict[str, int]:
+        completed = {}
+        try:
+            lines = self.completed_path.read_text(encoding='utf-8').splitlines()
+        except OSError:
+            return completed
+        for line in lines:
+            name, _, size = line.partition(' ')
+            if size.isdecimal():  # the last line may have been cut off by a crash
+                completed[name] = int(size)
+        return completed
+
+    def save(self):
+        with self.lock:
+            write_json(
+                self.path,
+                {'settings': self.settings, 'plan': self.plan.to_dict() if self.plan else None, 'frames': self.frames},
+            )
+
+    def _save_completed(self):
+        with self.lock:
+            tmp_path = self.completed_path.with_name(f'{self.completed_path.name}.tmp')
+            tmp_path.write_text(''.join(f'{name} {size}\n' for name, size in self.completed.items()), encoding='utf-8')
+            os.replace(tmp_path, self.completed_path)
+
+    def set_plan(self, plan: SegmentPlan):
+        self.plan = plan
+        self.completed = {}
+        self._save_completed()
+        self.save()
+
+    def set_frames(self, frames: Optional[int]):
+        self.frames = frames
+        self.save()
+
+    def mark_done(self, segment: Segment, section_path: Path):
+        size = section_path.stat().st_size
+        with self.lock:
+            self.completed[segment.name] = size
+            with open(self.completed_path, 'a', encoding='utf-8') as completed_file:
+                completed_file.write(f'{segment.name} {size}\n')
+
+    def is_done(self, segment: Segment) -> bool:
+        return segment.name in self.completed
+
+    def verify(self, folder: Path, threads: int):
+        """Forgets finished segments whose file went missing, changed size or lost frames."""
+
+        def is_intact(segment: Segment) -> bool:
+            section_path = folder / f'{segment.name}.webm'
+            try:
+                if section_path.stat().st_size != self.completed[segment.name]:
+                    return False
+                return ffmpeg_util.count_packets(section_path) == segment.frame_count
+            except (OSError, ffmpeg_util.FFMPEGExcption, IndexError, KeyError, ValueError):
+                return False
+
+        if self.plan is None:
+            return
+        segments = [segment for segment in self.plan.segments if self.is_done(segment)]
+        with ThreadPoolExecutor(max(1, threads)) as executor:
+            intact = list(executor.map(is_intact, segments))
+        with self.lock:
+            for segment, segment_intact in zip(segments, intact):
+                if not segment_intact:
+                    del self.completed[segment.name]
+        self._save_completed()
@@ -0,0 +1,81 @@
+import heapq
+import threading
+from concurrent.futures import FIRST_EXCEPTION, Future, wait
+from typing import Callable, Iterable, List, Tuple
+
+import util.trace as trace
+
+# (priority, order, submitted_at, max_threads, task, future)
+_Job = Tuple[int, int, float, int, Callable[[int], None], Future]
+
+
+class SegmentScheduler:
+    """Runs segment encodes while keeping the threads of all running encoders within `core_budget`.
+
+    With `longest_first`, the most expensive waiting segment starts first, otherwise segments start in submission
+    order. Threads are handed out when a segment starts: one each while there are more segments waiting than free
+    cores, and the free cores split between the remaining segments once the queue runs dry, so the tail of a render
+    doesn't leave cores idle. One scheduler can be shared by several renders.
+    """
+
+    __slots__ = ('core_budget', 'longest_first', 'used_cores', 'submitted', 'pending', 'condition')
+
+    def __init__(self, core_budget: int, longest_first: bool = True) -> None:
+        self.core_budget = max(1, core_budget)
+        self.longest_first = longest_first
+        self.used_cores = 0
+        self.submitted = 0
+        self.pending: List[_Job] = []
+        self.condition = threading.Condition()
+
+    def submit(self, cost: int, max_threads: int, task: Callable[[int], None]) -> Future:
+        """Queues `task`, which gets called with the number of threads it may use."""
+        return self.submit_many([(cost, max_threads, task)])[0]
+
+    def submit_many(self, tasks: Iterable[Tuple[int, int, Callable[[int], None]]]) -> List[Future]:
+        """Queues all `tasks` before starting any, so the longest of them can go first."""
+        futures = []
+        submitted_at = trace.now()
+        with self.condition:
+            for cost, max_threads, task in tasks:
+                future: Future = Future()
+                priority = -cost if self.longest_first else 0
+                heapq.heappush(
+                    self.pending, (priority, self.submitted, submitted_at, max(1, max_threads), task, future)
+                )
+                self.submitted += 1
+                futures.append(future)
+            self._dispatch()
+        return futures
+
+    def _dispatch(self):
+        while self.pending and self.used_cores < self.core_budget:
+            _, _, submitted_at, max_threads, task, future = heapq.heappop(self.pending)
+            if not future.set_running_or_notify_cancel():
+                continue
+            free_cores = self.core_budget - self.used_cores
+            threads = max(1, min(max_threads, free_cores // (len(self.pending) + 1)))
+            self.used_cores += threads
+            threading.Thread(target=self._run, args=(task, threads, future, submitted_at), daemon=True).start()
+
+    def _run(self, task: Callable[[int], None], threads: int, future: Future, submitted_at: float):
+        trace.add_span('queued', 'scheduler', submitted_at, trace.now(), {'threads': threads})
+        try:
+            task(threads)
+        except BaseException as error:  # pylint: disable=broad-except
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+        with self.condition:
+            self.used_cores -= threads
+            self._dispatch()
+
+
+def wait_for_all(futures: List[Future]):
+    """Waits for every future, or cancels the ones that haven't started and raises as soon as one fails."""
+    done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in done:
+        if future.exception() is not None:
+            for other in not_done:
+                other.cancel()
+            raise future.exception()  # type: ignore
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, List
+
+from util.cache_util import link_or_copy
+
+
+class SegmentCache:
+    """Content addressed store of encoded segment webms, bounded in size by evicting the least recently used ones."""
+
+    __slots__ = ('folder', 'max_size', 'source_digest')
+
+    def __init__(self, cache_dir: Path, max_size: int, source_digest: str) -> None:
+        self.folder = cache_dir / 'segments'
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.source_digest = source_digest
+
+    def key(self, *settings: Any) -> str:
+        return hashlib.sha256(json.dumps([self.source_digest, *settings], default=str).encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.folder / key[:2] / f'{key}.webm'
+
+    def fetch(self, key: str, destination: Path) -> bool:
+        cached_path = self.path(key)
+        try:
+            link_or_copy(cached_path, destination)
+            os.utime(cached_path)  # mark as recently used
+        except FileNotFoundError:
+            # evicted by a concurrent render, possibly after linking; the encoder must not write through that link
+            destination.unlink(missing_ok=True)
+            return False
+        return True
+
+    def store(self, key: str, source: Path):
+        cached_path = self.path(key)
+        cached_path.parent.mkdir(exist_ok=True)
+        tmp_path = cached_path.with_name(f'{cached_path.name}.{os.getpid()}.tmp')
+        link_or_copy(source, tmp_path)
+        os.replace(tmp_path, cached_path)
+
+    def evict(self):
+        entries: List[os.stat_result] = []
+        paths: List[Path] = []
+        for cached_path in self.folder.glob('*/*.webm'):
+            try:
+                entries.append(cached_path.stat())
+            except FileNotFoundError:
+                continue
+            paths.append(cached_path)
+
+        total_size = sum(entry.st_size for entry in entries)
+        for entry, cached_path in sorted(zip(entries, paths), key=lambda x: x[0].st_mtime):
+            if total_size <= self.max_size:
+                break
+            cached_path.unlink(missing_ok=True)
+            total_size -= entry.st_size
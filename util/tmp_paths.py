@@ -1,30 +1,78 @@
+import shutil
 import tempfile
 from pathlib import Path
+from typing import Optional
+
+from util.frame_store import FRAME_STORES, FrameStore
 
 
 class TmpPaths:
-    temp_dir: tempfile.TemporaryDirectory
-    tmp_folder: Path
-    tmp_frames: Path
-    tmp_resized_frames: Path
-    tmp_audio: Path
-    tmp_concat_list: Path
-    tmp_frame_files: Path
-
-    @classmethod
-    def build_tmp_paths(cls):
-        cls.temp_dir = tempfile.TemporaryDirectory()
-        cls.tmp_folder = Path(cls.temp_dir.name)
-
-        cls.tmp_frames = cls.tmp_folder / 'tempFrames'
-        cls.tmp_frames.mkdir(parents=True, exist_ok=True)
-        cls.tmp_resized_frames = cls.tmp_folder / 'tempResizedFrames'
-        cls.tmp_resized_frames.mkdir(parents=True, exist_ok=True)
-
-        cls.tmp_audio = cls.tmp_folder / 'tempAudio.webm'
-        cls.tmp_concat_list = cls.tmp_folder / 'tempConcatList.txt'
-        cls.tmp_frame_files = cls.tmp_frames / '%05d.png'
-
-    @classmethod
-    def cleanup(cls):
-        cls.temp_dir.cleanup()
+    __slots__ = (
+        'temp_dir',
+        'tmp_folder',
+        'tmp_frames',
+        'tmp_resized_frames',
+        'tmp_audio',
+        'tmp_concat_list',
+        'frame_store',
+        'manifest',
+        'completed_segments',
+        'separate_frames',
+    )
+
+    def __init__(
+        self,
+        folder: Optional[Path] = None,
+        frame_store: str = 'png',
+        frame_dir: Optional[Path] = None,
+        transparent: bool = False,
+    ) -> None:
+        # a given folder is kept until cleanup, so it can outlive a failed render
+        self.temp_dir = None if folder else tempfile.TemporaryDirectory()
+        self.tmp_folder = folder or Path(self.temp_dir.name)  # type: ignore
+
+        # frames in a folder of their own (e.g. on a RAM disk) have to fit there, and are never resumed from
+        self.separate_frames = frame_dir is not None
+        if frame_dir:
+            self.tmp_frames = Path(tempfile.mkdtemp(prefix='wackypywebm_', dir=frame_dir))
+        else:
+            self.tmp_frames = self.tmp_folder / 'tempFrames'
+        self.frame_store: FrameStore = FRAME_STORES[frame_store](
+            self.tmp_frames, transparent, check_capacity=frame_dir is not None
+        )
+        self.tmp_resized_frames = self.tmp_folder / 'tempResizedFrames'
+        self.tmp_resized_frames.mkdir(parents=True, exist_ok=True)
+
+        self.tmp_audio = self.tmp_folder / 'tempAudio.webm'
+        self.tmp_concat_list = self.tmp_folder / 'tempConcatList.txt'
+        self.manifest = self.tmp_folder / 'manifest.json'
+        self.completed_segments = self.tmp_folder / 'completedSegments.txt'
+
+    def count_frame_files(self) -> int:
+        return self.frame_store.count_frames()
+
+    def clear(self):
+        """Removes what earlier renders left in the folder."""
+        self.frame_store.clear()
+        shutil.rmtree(self.tmp_resized_frames, ignore_errors=True)
+        self.tmp_resized_frames.mkdir()
+        for path in (self.tmp_audio, self.tmp_concat_list, self.manifest, self.completed_segments):
+            path.unlink(missing_ok=True)
+
+    def remove_separate_frames(self):
+        """Removes frames kept in a folder of their own, which a kept work folder has no use for."""
+        if self.separate_frames:
+            shutil.rmtree(self.tmp_frames, ignore_errors=True)
+
+    def cleanup(self):
+        if self.temp_dir:
+            shutil.rmtree(self.tmp_frames, ignore_errors=True)  # may be outside of the temporary folder
+            self.temp_dir.cleanup()
+            return
+        # only remove what renders put there, the folder may have been picked by hand
+        self.clear()
+        for path in (self.tmp_frames, self.tmp_resized_frames, self.tmp_folder):
+            try:
+                path.rmdir()
+            except OSError:
+                pass
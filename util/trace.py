@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Trace:
+    """Spans recorded while tracing is on, in Chrome trace event format (chrome://tracing, ui.perfetto.dev)."""
+
+    enabled = False
+    events: List[Dict[str, Any]] = []
+    thread_names: Dict[int, str] = {}
+    lock = threading.Lock()
+
+
+def start():
+    with Trace.lock:
+        Trace.events = []
+        Trace.thread_names = {}
+        Trace.enabled = True
+
+
+def now() -> float:
+    return time.perf_counter()
+
+
+def add_span(name: str, category: str, start_time: float, end_time: float, args: Optional[Dict[str, Any]] = None):
+    """Records a span between two `now()` timestamps."""
+    if not Trace.enabled:
+        return
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': start_time * 1_000_000,
+        'dur': (end_time - start_time) * 1_000_000,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args or {},
+    }
+    with Trace.lock:
+        Trace.events.append(event)
+        Trace.thread_names[event['tid']] = threading.current_thread().name
+
+
+@contextmanager
+def span(name: str, category: str = 'phase', **args: Any) -> Iterator[Dict[str, Any]]:
+    """Records the time spent in the block. Whatever the block adds to the yielded dict ends up in the span's args."""
+    start_time = now()
+    try:
+        yield args
+    finally:
+        add_span(name, category, start_time, now(), args)
+
+
+def stop() -> List[Dict[str, Any]]:
+    """Stops tracing and returns the recorded spans."""
+    with Trace.lock:
+        Trace.enabled = False
+        return Trace.events
+
+
+def save(trace_path: Path):
+    with Trace.lock:
+        Trace.enabled = False
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': thread_name}}
+            for tid, thread_name in Trace.thread_names.items()
+        ]
+        trace_path.write_text(
+            json.dumps({'traceEvents': metadata + Trace.events, 'displayTimeUnit': 'ms'}), encoding='utf-8'
+        )
@@ -1,22 +1,69 @@
+import copy
+import cProfile
+import math
+import shlex
 import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-
-from natsort import natsorted
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import localization
 import util.args_util as args_util
 import util.ffmpeg_util as ffmpeg_util
 import util.terminal_util as terminal_util
-from data import BaseData, Data, SetupData
-from modes.mode_base import FrameBounds, ModeBase, load_modes
+import util.trace as trace
+from data import BaseData, SetupData
+from localization import localize_str
+from modes.mode_base import ModeBase, load_modes
+from segment_plan import Segment, SegmentPlan, build_segment_plan, estimate_encode_cost
+from util.audio_levels import AudioLevels
+from util.cache_util import get_cache_dir, get_file_digest, read_json, write_json
+from util.frame_extractor import FrameExtractor
+from util.frame_pipe import FramePipe
+from util.frame_store import FRAME_STORES, WindowedFrameStore
+from util.render_manifest import RenderManifest
+from util.progress import ProgressSubscriber, ProgressTracker, print_progress_bar
+from util.scheduler import SegmentScheduler, wait_for_all
+from util.segment_cache import SegmentCache
 from util.tmp_paths import TmpPaths
 from wackify_state import WackifyState
 
 MODES: Dict[str, ModeBase] = load_modes()
+# modes keep what they set up on the class, so setting up and planning one render has to finish before the next
+MODES_LOCK = threading.Lock()
+# options of the whole render, which every mode set rendered alongside others has to use as well
+SHARED_OPTIONS = [
+    'output',
+    'language',
+    'threads',
+    'frame_transport',
+    'frame_store',
+    'frame_dir',
+    'frame_window',
+    'cache',
+    'cache_dir',
+    'cache_size',
+    'trace',
+    'profile',
+    'resume',
+    'work_dir',
+    'plan',
+    'plan_only',
+]
+
+
+class Variant:
+    """One mode set of the modes argument, with the options it was given on top of the shared ones."""
+
+    __slots__ = ('modes', 'args', 'name')
+
+    def __init__(self, modes: List[str], args: args_util.IArgs, name: str) -> None:
+        self.modes = modes
+        self.args = args
+        self.name = name  # unique among the variants, names their output file and segment folder
 
 
 def print_config(
@@ -36,18 +83,373 @@ def print_config(
     localization.print('config_footer')
 
 
-def wackify(selected_modes: List[str], video_path: Path, args: args_util.IArgs, output_path: Optional[Path]):
+def encode_segment(
+    ws: WackifyState,
+    segment: Segment,
+    bitrate: Union[str, int],
+    frame_pipe: Optional[FramePipe],
+    segment_frames: Optional[bytes],
+    video_path: Optional[Path],
+    callback: Callable[[], None],
+    threads: int,
+):
+    command, section_path = ws.generate_ffmpeg_command(segment, bitrate, threads, frame_pipe, video_path)
+    stderr = ffmpeg_util.exec_command(command, stdin=segment_frames)
+    if video_path:
+        # seeking goes by timestamps, which start at the seek point half a frame before the planned first frame
+        first_frame_time = ffmpeg_util.get_first_frame_time(stderr)
+        offset = round(first_frame_time * ffmpeg_util.parse_fps(ws.fps) - 0.5) if first_frame_time is not None else 0
+        if first_frame_time is None or offset != 0:
+            raise ffmpeg_util.FFMPEGExcption(
+                localize_str(
+                    'seek_frames_mismatch',
+                    args={'segment': segment.name, 'frame': segment.start + offset, 'expected': segment.start},
+                )
+            )
+    callback()
+
+
+def store_in_cache(segment_cache: SegmentCache, cache_key: str, section_path: Path, callback: Callable[[], None]):
+    segment_cache.store(cache_key, section_path)
+    callback()
+
+
+def release_frames(frame_extractor: FrameExtractor, segment: Segment, callback: Callable[[], None]):
+    frame_extractor.release(segment.start, segment.frame_count)
+    callback()
+
+
+def stop_on_failure(frame_extractor: FrameExtractor, future: Future):
+    # a failed encode never releases its frames, waiting for room in the window would never end
+    if not future.cancelled() and future.exception() is not None:
+        frame_extractor.stop()
+
+
+def mark_done(manifest: RenderManifest, segment: Segment, section_path: Path, callback: Callable[[], None]):
+    manifest.mark_done(segment, section_path)
+    callback()
+
+
+def wackify(
+    selected_modes: List[str],
+    video_path: Path,
+    args: args_util.IArgs,
+    output_path: Optional[Path],
+    progress_subscribers: Optional[List[ProgressSubscriber]] = None,
+    scheduler: Optional[SegmentScheduler] = None,
+) -> SegmentPlan:
+    """Renders `video_path` to `output_path`.
+
+    Progress goes to `progress_subscribers`, the console bar by default. Segments are encoded through `scheduler`,
+    which several renders can share, or through a scheduler of their own.
+    """
     ws = WackifyState(MODES, selected_modes)
+    work_dir = get_work_dir(args, output_path)
+    ws.tmp_paths = TmpPaths(work_dir, args.frame_store, args.frame_dir, transparent='transparency' in selected_modes)
+    if work_dir:
+        ws.manifest = open_manifest(ws.tmp_paths, video_path, selected_modes, args)
+        if ws.manifest.plan is None:
+            ws.tmp_paths.clear()  # nothing to resume, whatever is there belongs to some other render
+    succeeded = False
+    try:
+        start_up(ws, video_path, args)
+        plan_segments(ws, video_path, args)
+
+        start_time = time.perf_counter()
+        localization.print('starting_conversion')
+        with trace.span('encode', frames=ws.num_frames):
+            encode_segments(ws, video_path, args, progress_subscribers, scheduler)
+        end_time = time.perf_counter()
+        localization.print(
+            'done_conversion', args={'time': f'{end_time - start_time:.2f}', 'framecount': ws.num_frames}
+        )
+
+        with trace.span('concat'):
+            concatenate_segments(ws, output_path)
+        succeeded = True
+    finally:
+        if ws.frame_extractor and ws.frame_extractor.running:
+            # failed before encoding took care of it, e.g. while planning
+            ws.frame_extractor.terminate()
+        if succeeded or work_dir is None:
+            ws.tmp_paths.cleanup()
+        else:
+            ws.tmp_paths.remove_separate_frames()  # e.g. on a RAM disk, and never resumed from
+            localization.print('work_dir_kept', args={'path': work_dir})
+    localization.print('done_removing_temp')
+    print('Wackified:', output_path)
+    return ws.plan
+
+
+def wackify_variants(
+    variants: List[Variant],
+    video_path: Path,
+    args: args_util.IArgs,
+    output_paths: List[Path],
+    scheduler: Optional[SegmentScheduler] = None,
+) -> List[SegmentPlan]:
+    """Renders `video_path` once for every mode set in `variants`, to the matching `output_paths`.
+
+    The input is probed, split into audio and frames, and its audio analysed only once for all of them, and all their
+    segments are encoded through one scheduler. Frames are shared, so streaming them with the pipe transport and
+    removing them through a frame window aren't possible; those fall back to extracting every frame.
+    """
+    share_frames(args)
+    all_modes = list(dict.fromkeys(mode for variant in variants for mode in variant.modes))
+    shared = WackifyState(MODES, all_modes)
+    shared.tmp_paths = TmpPaths(
+        frame_store=args.frame_store, frame_dir=args.frame_dir, transparent='transparency' in all_modes
+    )
+    try:
+        start_up(shared, video_path, args)
+        share_options(variants, args)
+
+        states: List[WackifyState] = []
+        for variant in variants:
+            ws = WackifyState(MODES, variant.modes)
+            for attribute in ('width', 'height', 'fps', 'num_frames', 'delta', 'has_audio', 'tmp_paths'):
+                setattr(ws, attribute, getattr(shared, attribute))
+            ws.frame_extractor = shared.frame_extractor
+            ws.variant = variant.name
+            (ws.tmp_paths.tmp_resized_frames / ws.variant).mkdir()
+            plan_segments(ws, video_path, variant.args)
+            states.append(ws)
+
+        if scheduler is None:
+            scheduler = SegmentScheduler(args.threads, longest_first=args.frame_transport in ('png', 'seek'))
+        progress = ProgressTracker(sum(ws.num_frames for ws in states))
+        progress.subscribe(print_progress_bar)
+        progress.start()
+        start_time = time.perf_counter()
+        localization.print('starting_conversion')
+        try:
+            with trace.span('encode', frames=progress.total_frames), ThreadPoolExecutor(len(states)) as executor:
+                wait_for_all(
+                    [
+                        executor.submit(encode_segments, ws, video_path, variant.args, None, scheduler, progress)
+                        for ws, variant in zip(states, variants)
+                    ]
+                )
+        finally:
+            progress.finish()
+            print()
+        terminal_util.fix_terminal()  # exit progress bar line
+        end_time = time.perf_counter()
+        localization.print(
+            'done_conversion', args={'time': f'{end_time - start_time:.2f}', 'framecount': progress.total_frames}
+        )
+
+        with trace.span('concat', variants=len(states)):
+            for ws, output_path in zip(states, output_paths):
+                concatenate_segments(ws, output_path)
+    finally:
+        if shared.frame_extractor and shared.frame_extractor.running:
+            shared.frame_extractor.terminate()
+        shared.tmp_paths.cleanup()
+    localization.print('done_removing_temp')
+    for output_path in output_paths:
+        print('Wackified:', output_path)
+    return [ws.plan for ws in states]
+
+
+def share_frames(args: args_util.IArgs):
+    """Switches to a frame transport several mode sets can share frames through."""
+    if args.frame_transport == 'pipe' or args.frame_window:
+        localization.print('variants_shared_frames')
+        args.frame_transport = 'png' if args.frame_transport == 'pipe' else args.frame_transport
+        args.frame_window = 0
+
+
+def share_options(variants: List[Variant], args: args_util.IArgs):
+    """Gives every variant the shared options `args` ended up with, e.g. after `share_frames` or probing the bitrate."""
+    for variant in variants:
+        for option in SHARED_OPTIONS:
+            setattr(variant.args, option, getattr(args, option))
+        if variant.args.bitrate is None:
+            variant.args.bitrate = args.bitrate
+
+
+def parse_variants(args: args_util.IArgs) -> List[Variant]:
+    """Mode sets separated by ";" in `args.modes`, each optionally followed by options that only apply to it.
+
+    Sets repeated with the same options are only rendered once, sets repeated with other options get a number added
+    to their name.
+    """
+    variants: List[Variant] = []
+    seen = set()
+    for text in args.modes.split(';'):
+        tokens = shlex.split(text)
+        if not tokens:
+            continue
+        modes = [mode.lower() for mode in tokens[0].split('+')]
+        if (tuple(modes), tuple(tokens[1:])) in seen:
+            continue
+        seen.add((tuple(modes), tuple(tokens[1:])))
+
+        variant_args = copy.copy(args)
+        if len(tokens) > 1:
+            variant_args = args_util.parse_args([str(args.file), tokens[0], *tokens[1:]], namespace=variant_args)
+        for option in SHARED_OPTIONS:
+            if getattr(variant_args, option) != getattr(args, option):
+                localization.print('variant_shared_option', args={'variant': text.strip(), 'option': option})
+                sys.exit(1)
 
-    video_info = ffmpeg_util.get_video_info(video_path)
-    (ws.width, ws.height), ws.fps, bitrate, ws.num_frames = video_info
+        name = '_'.join(modes)
+        taken = {variant.name for variant in variants}
+        number = 2
+        while name in taken:
+            name = f'{"_".join(modes)}_{number}'
+            number += 1
+        variants.append(Variant(modes, variant_args, name))
+    return variants
+
+
+def plan_only(variants: List[Variant], video_path: Path, args: args_util.IArgs, plan_path: Path) -> List[SegmentPlan]:
+    """Plans the render of every mode set in `variants` like `wackify` and `wackify_variants` would, without
+    extracting or encoding anything. The plans and a rough estimate of what encoding them costs go to `plan_path`,
+    which `--plan` renders from later.
+    """
+    if len(variants) > 1:
+        share_frames(args)
+    share_options(variants, args)
+    # no frames are extracted to count them, so the probe has to be exact
+    with trace.span('probe'):
+        (width, height), fps, bitrate, num_frames = ffmpeg_util.get_video_info(video_path, exact_frame_count=True)
+    delta = find_min_size(width, height, args.cache_dir)
+    has_audio = ffmpeg_util.has_audio_stream(video_path)
+    localization.print('info1', args={'delta': delta, 'video': video_path})
+    localization.print(
+        'info2',
+        args={
+            'w': width,
+            'h': height,
+            'framerate': fps,
+            'decframerate': ffmpeg_util.parse_fps(fps),
+            'bitrate': bitrate,
+        },
+    )
+
+    plans: List[SegmentPlan] = []
+    entries: Dict[str, Any] = {}
+    for variant in variants:
+        ws = WackifyState(MODES, variant.modes)
+        ws.width, ws.height, ws.fps, ws.num_frames = width, height, fps, num_frames
+        ws.delta, ws.has_audio = delta, has_audio
+        plan_segments(ws, video_path, variant.args)
+        estimate = estimate_encode_cost(ws.plan, args.threads, args.frame_transport)
+        entries[variant.name] = {
+            'settings': get_plan_settings(video_path, variant.args),
+            'plan': ws.plan.to_dict(),
+            'estimate': estimate,
+        }
+        localization.print(
+            'plan_estimate',
+            args={
+                'modes': variant.name,
+                'framecount': estimate['frames'],
+                'segments': estimate['segments'],
+                'processes': estimate['ffmpeg_processes'],
+                'cost': estimate['relative_cost'],
+                'threads': args.threads,
+            },
+        )
+        plans.append(ws.plan)
+
+    write_json(plan_path, {'video': str(video_path), 'plans': entries})
+    localization.print('plan_written', args={'path': plan_path})
+    return plans
+
+
+def load_plan(ws: WackifyState, video_path: Path, args: args_util.IArgs) -> SegmentPlan:
+    """Plan of `ws`'s variant from the `--plan` file, as long as it was made for the same input and options."""
+    data = read_json(args.plan)
+    entry = data.get('plans', {}).get(ws.variant or '_'.join(ws.selected_modes))
+    plan = SegmentPlan.from_dict(entry['plan']) if entry else None
+    # the settings include the video's digest; frames extracted to disk are counted instead of probed like for the plan
+    if plan is None or entry['settings'] != get_plan_settings(video_path, args) or plan.num_frames != ws.num_frames:
+        localization.print('plan_mismatch', args={'path': args.plan})
+        sys.exit(1)
+    return plan
+
+
+def get_work_dir(args: args_util.IArgs, output_path: Path) -> Optional[Path]:
+    """Folder that is kept when the render fails, None for a temporary one."""
+    if args.work_dir:
+        return args.work_dir.resolve()
+    if args.resume:
+        return output_path.with_name(f'{output_path.name}.parts')
+    return None
+
+
+def get_plan_settings(video_path: Path, args: args_util.IArgs) -> Dict[str, Any]:
+    """Everything besides the modes that changes the plan."""
+    cache_dir = get_cache_dir(args.cache_dir)
+    return {
+        'video': get_file_digest(video_path, cache_dir),
+        'keyframes': get_file_digest(args.keyframes, cache_dir) if args.keyframes else None,
+        **{
+            key: getattr(args, key) for key in ['tempo', 'angle', 'compression', 'transparency', 'smoothing', 'threads']
+        },
+        'frame_transport': args.frame_transport,
+        'frame_window': get_frame_window(args),
+    }
+
+
+def open_manifest(
+    tmp_paths: TmpPaths, video_path: Path, selected_modes: List[str], args: args_util.IArgs
+) -> RenderManifest:
+    # everything that changes the plan or the encoded segments
+    settings = {
+        **get_plan_settings(video_path, args),
+        'modes': selected_modes,
+        'bitrate': args.bitrate,
+    }
+    return RenderManifest(tmp_paths.manifest, tmp_paths.completed_segments, settings, load=args.resume)
+
+
+def start_up(ws: WackifyState, video_path: Path, args: args_util.IArgs):
+    """Probes the input, splits off its audio and frames and analyses its audio.
+
+    These steps only read the input, so they run side by side, with the ones that need the probe's results started
+    as soon as it is done.
+    """
+    if args.frame_transport == 'seek' and not ffmpeg_util.has_constant_frame_rate(video_path):
+        localization.print('seek_variable_frame_rate')
+        sys.exit(1)
+    localization.print('creating_temp_dirs', args={'path': ws.tmp_paths.tmp_folder})
+    frame_store = ws.tmp_paths.frame_store
+    with ThreadPoolExecutor(4) as executor:
+        audio_split = executor.submit(extract_audio, ws, video_path)
+        frame_split = None
+        if not (frame_store.sized or frame_store.check_capacity):
+            frame_split = executor.submit(extract_frames, ws, video_path, args)
+
+        # frames extracted to disk are counted afterwards, every other transport plans straight from the probed count
+        with trace.span('probe'):
+            video_info = ffmpeg_util.get_video_info(video_path, exact_frame_count=args.frame_transport != 'png')
+        (ws.width, ws.height), ws.fps, bitrate, num_frames = video_info
+        if args.frame_transport in ('png', 'overlap'):
+            # through a frame window, no more than the window's frames are ever on disk at once
+            frame_store.prepare(ws.width, ws.height, min(num_frames, get_frame_window(args) or num_frames))
+        if frame_split is None:
+            frame_split = executor.submit(extract_frames, ws, video_path, args)
+
+        min_size = executor.submit(find_min_size, ws.width, ws.height, args.cache_dir)
+        audio_analysis = None
+        if any(MODES[mode].needs_audio for mode in ws.selected_modes):
+            audio_analysis = executor.submit(analyse_audio, video_path, ffmpeg_util.parse_fps(ws.fps), args.cache_dir)
+
+        ws.delta = min_size.result()
+        ws.num_frames = frame_split.result() or num_frames
+        audio_split.result()
+        if audio_analysis and ws.has_audio:
+            # without audio, planning reports which modes need it instead
+            audio_analysis.result()
 
     if args.bitrate is None:
         args.bitrate = min(bitrate or 500_000, 1_000_000)
 
-    ws.delta = ffmpeg_util.find_min_non_error_size(ws.width, ws.height)
     localization.print('info1', args={'delta': ws.delta, 'video': video_path})
-
     localization.print(
         'info2',
         args={
@@ -58,95 +460,252 @@ def wackify(selected_modes: List[str], video_path: Path, args: args_util.IArgs,
             'bitrate': bitrate,
         },
     )
+    print_config(ws.selected_modes, args, video_info)
 
-    print_config(selected_modes, args, video_info)
 
-    TmpPaths.build_tmp_paths()
-    localization.print('creating_temp_dirs', args={'path': TmpPaths.tmp_folder})
+def find_min_size(width: int, height: int, cache_dir: Optional[Path]) -> int:
+    with trace.span('min_size'):
+        return ffmpeg_util.find_min_non_error_size(width, height, cache_dir)
 
-    localization.print('splitting_audio')
-    ws.has_audio = ffmpeg_util.split_audio(video_path)
 
-    localization.print('splitting_frames')
-    ffmpeg_util.split_frames(video_path, transparent='transparency' in selected_modes, threads=args.threads)
+def analyse_audio(video_path: Path, fps: float, cache_dir: Optional[Path]):
+    with trace.span('audio_analysis'):
+        AudioLevels.get(video_path, fps, cache_dir)
 
-    setup_data = SetupData(
-        video_path, ws.width, ws.height, ws.num_frames, ffmpeg_util.parse_fps(ws.fps), args.keyframes
-    )
-    base_data = BaseData(
-        ws.width, ws.height, ws.num_frames, ffmpeg_util.parse_fps(ws.fps), args.tempo, args.angle, args.transparency
+
+def extract_audio(ws: WackifyState, video_path: Path):
+    localization.print('splitting_audio')
+    with trace.span('audio_split'):
+        ws.has_audio = ffmpeg_util.split_audio(video_path, ws.tmp_paths)
+
+
+def get_frame_window(args: args_util.IArgs) -> int:
+    """How many extracted frames can be on disk at once, 0 for no limit."""
+    if args.frame_transport != 'overlap' or not issubclass(FRAME_STORES[args.frame_store], WindowedFrameStore):
+        return 0
+    return max(0, args.frame_window)
+
+
+def extract_frames(ws: WackifyState, video_path: Path, args: args_util.IArgs) -> Optional[int]:
+    """Splits the input into frames, returning how many there are if that is known by the time this returns."""
+    transparent = 'transparency' in ws.selected_modes
+    if args.frame_transport == 'overlap':
+        # runs in the background, segments get encoded as soon as their frames are on disk
+        localization.print('overlapping_frames')
+        ws.frame_extractor = FrameExtractor(
+            video_path, ws.tmp_paths, transparent, threads=args.threads, window=get_frame_window(args)
+        )
+    elif args.frame_transport == 'png':
+        if ws.manifest and ws.manifest.plan and ws.manifest.frames == ws.tmp_paths.count_frame_files():
+            return ws.manifest.frames  # left over from the run being resumed
+
+        localization.print('splitting_frames')
+        if ws.manifest:
+            ws.manifest.set_frames(None)  # not to be trusted until the split is done
+        with trace.span('frame_split', threads=args.threads) as span_args:
+            span_args['frames'] = ffmpeg_util.split_frames(
+                video_path, ws.tmp_paths, transparent=transparent, threads=args.threads
+            )
+        if ws.manifest:
+            ws.manifest.set_frames(span_args['frames'])
+        return span_args['frames']
+    return None
+
+
+def plan_segments(ws: WackifyState, video_path: Path, args: args_util.IArgs):
+    if ws.manifest and ws.manifest.plan:
+        # the plan of the run being resumed, planning again could give other segments, e.g. with sporadic
+        ws.plan = ws.manifest.plan
+        ws.manifest.verify(ws.tmp_paths.tmp_resized_frames, args.threads)
+        localization.print('resuming', args={'done': len(ws.manifest.completed), 'segments': len(ws.plan.segments)})
+        return
+
+    if args.plan and not args.plan_only:
+        # planned ahead with --plan-only, so the modes don't even have to be set up
+        ws.plan = load_plan(ws, video_path, args)
+    else:
+        setup_data = SetupData(
+            video_path,
+            ws.width,
+            ws.height,
+            ws.num_frames,
+            ffmpeg_util.parse_fps(ws.fps),
+            args.keyframes,
+            args.cache_dir,
+        )
+        base_data = BaseData(
+            ws.width, ws.height, ws.num_frames, ffmpeg_util.parse_fps(ws.fps), args.tempo, args.angle, args.transparency
+        )
+
+        frame_window = get_frame_window(args)
+        if args.frame_transport == 'pipe':
+            # piped segments are held in memory whole, their length has to be bounded however long the video is
+            frame_window = FramePipe.get_frame_window(ws.width, ws.height, 'transparency' in ws.selected_modes)
+
+        with trace.span('planning', modes='+'.join(ws.selected_modes)) as span_args, MODES_LOCK:
+            for mode in ws.selected_modes:
+                if not ws.has_audio and MODES[mode].needs_audio:
+                    print(f"ERROR: Mode '{mode.title()}' needs audio!")
+                    sys.exit(1)
+                MODES[mode].setup(setup_data)
+
+            ws.plan = build_segment_plan(
+                MODES,
+                ws.selected_modes,
+                base_data,
+                ws.fps,
+                ws.delta,
+                smoothing=args.smoothing,
+                compression=args.compression,
+                threads=args.threads,
+                frame_window=frame_window,
+            )
+            span_args['segments'] = len(ws.plan.segments)
+            span_args['max_error'] = ws.plan.max_error
+    if ws.manifest:
+        ws.manifest.set_plan(ws.plan)
+    localization.print(
+        'segment_plan_info',
+        args={'segments': len(ws.plan.segments), 'framecount': ws.plan.num_frames, 'error': ws.plan.max_error},
     )
 
-    for mode in selected_modes:
-        try:
-            if not ws.has_audio and getattr(MODES[mode], 'frames_audio_levels') == []:
-                print(f"ERROR: Mode '{mode.title()}' needs audio!")
-                sys.exit(1)
-        except AttributeError:
-            pass
-        MODES[mode].setup(setup_data)
-
-    start_time = time.perf_counter()
-    localization.print('starting_conversion')
-
-    ws.generate_smoothing_buffer(args.smoothing)
-
-    ws.start_progress_tracking()
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
-        for i, frame_path in enumerate(natsorted(TmpPaths.tmp_frames.glob('*.png')), start=1):
-            data = Data(base_data, (i - 1), frame_path)
-
-            ws.frame_bounds = FrameBounds(ws.width, ws.height)
-            ws.apply_frame_bounds_from_selected_modes(data)
-
-            if args.smoothing:
-                ws.apply_smoothing(args.smoothing)
-
-            if i == 1:
-                ws.update_prev_frame()
-
-            if (
-                ws.sum_of_abs_diff_width_n_height > args.compression
-                or i == ws.num_frames
-                or ws.same_size_count > (ws.num_frames // args.threads)
-            ):
-                command, section_path = ws.generate_ffmpeg_command(i, frame_path, args.bitrate, args.threads)
-                executor.submit(
-                    ffmpeg_util.exec_command,
-                    command,
-                    callback=partial(ws.update_progress_tracking, i, ws.same_size_count),
+
+def encode_segments(
+    ws: WackifyState,
+    video_path: Path,
+    args: args_util.IArgs,
+    progress_subscribers: Optional[List[ProgressSubscriber]] = None,
+    scheduler: Optional[SegmentScheduler] = None,
+    progress: Optional[ProgressTracker] = None,
+):
+    """Encodes the planned segments. A `progress` tracker given is shared with other renders, and the caller starts
+    and finishes it."""
+    transparent = 'transparency' in ws.selected_modes
+
+    segment_cache: Optional[SegmentCache] = None
+    if args.cache:
+        cache_dir = get_cache_dir(args.cache_dir)
+        segment_cache = SegmentCache(cache_dir, args.cache_size * 1024 * 1024, get_file_digest(video_path, cache_dir))
+
+    frame_pipe: Optional[FramePipe] = None
+    if args.frame_transport == 'pipe':
+        localization.print('streaming_frames')
+        frame_pipe = FramePipe(video_path, ws.width, ws.height, transparent, threads=args.threads)
+    # segments decode their own frames straight from the input
+    seek_path = video_path if args.frame_transport == 'seek' else None
+    if scheduler is None:
+        # streamed and overlapped frames arrive in plan order, so there is nothing to gain from reordering them
+        scheduler = SegmentScheduler(args.threads, longest_first=args.frame_transport in ('png', 'seek'))
+    # piped frames stay in memory until their encoder has consumed them, so cap how many segments are read ahead;
+    # segments are planned short enough for that to stay around MAX_BUFFERED_BYTES
+    in_flight = threading.BoundedSemaphore(args.threads + 1)
+
+    ws.progress = progress or ProgressTracker(ws.num_frames)
+    if progress is None:
+        for subscriber in [print_progress_bar] if progress_subscribers is None else progress_subscribers:
+            ws.progress.subscribe(subscriber)
+        ws.progress.start()
+    tasks: List[Tuple[int, int, Callable[[int], None]]] = []
+    futures: List[Future] = []
+    try:
+        for segment in ws.plan.segments:
+            section_path = ws.get_section_path(segment)
+            callback = partial(ws.progress.update, segment.start, segment.frame_count)
+            if frame_pipe:
+                in_flight.acquire()
+            segment_frames = frame_pipe.read_frames(segment.frame_count) if frame_pipe else None
+            if frame_pipe and not segment_frames:
+                break
+            # finished by the run being resumed
+            done = ws.manifest is not None and ws.manifest.is_done(segment)
+            if ws.frame_extractor and (not done or ws.frame_extractor.window):
+                # windowed frames have to be waited for even if unused, to remove them again
+                if ws.frame_extractor.wait_for_frames(segment.end, segment.start) < segment.start:
+                    break
+                callback = partial(release_frames, ws.frame_extractor, segment, callback)
+            ws.tmp_webm_files.append(f'file {ffmpeg_util.get_valid_path(section_path)}\n')
+
+            if done:
+                callback()
+                if frame_pipe:
+                    in_flight.release()
+                continue
+            if ws.manifest:
+                callback = partial(mark_done, ws.manifest, segment, section_path, callback)
+
+            if segment_cache:
+                # frames reach the encoder differently per transport, seeking for one decodes the input on its own
+                cache_key = segment_cache.key(
+                    segment.start,
+                    ws.fps,
+                    transparent,
+                    args.frame_transport,
+                    ws.generate_encoder_args(segment, args.bitrate),
                 )
-                ws.tmp_webm_files.append(f'file {ffmpeg_util.get_valid_path(section_path)}\n')
-                ws.same_size_count = 1
-                ws.update_prev_frame()
+                if segment_cache.fetch(cache_key, section_path):
+                    callback()
+                    if frame_pipe:
+                        in_flight.release()
+                    continue
+                callback = partial(store_in_cache, segment_cache, cache_key, section_path, callback)
+
+            task = (
+                segment.estimated_cost,
+                math.ceil(segment.frame_count / 10),
+                partial(encode_segment, ws, segment, args.bitrate, frame_pipe, segment_frames, seek_path, callback),
+            )
+            if frame_pipe:
+                futures.append(scheduler.submit(*task))
+                futures[-1].add_done_callback(lambda _: in_flight.release())
+            elif ws.frame_extractor:
+                # its frames are on disk, start encoding while the next segment's are still being extracted
+                futures.append(scheduler.submit(*task))
+                futures[-1].add_done_callback(partial(stop_on_failure, ws.frame_extractor))
             else:
-                ws.same_size_count += 1
-
-    ws.finish_progress_tracking()
-    terminal_util.fix_terminal()  # exit progress bar line
-
-    end_time = time.perf_counter()
-    localization.print('done_conversion', args={'time': f'{end_time - start_time:.2f}', 'framecount': ws.num_frames})
-
+                tasks.append(task)
+        futures += scheduler.submit_many(tasks)
+        wait_for_all(futures)
+    except BaseException:
+        if frame_pipe:
+            frame_pipe.terminate()
+        if ws.frame_extractor:
+            ws.frame_extractor.terminate()
+        raise
+    finally:
+        if progress is None:
+            ws.progress.finish()
+            print()
+
+    if frame_pipe:
+        frame_pipe.close()
+    if ws.frame_extractor:
+        ws.frame_extractor.close()
+    if segment_cache:
+        segment_cache.evict()
+    if progress is None:
+        terminal_util.fix_terminal()  # exit progress bar line
+
+
+def concatenate_segments(ws: WackifyState, output_path: Path):
     localization.print('writing_concat_file')
-    with open(TmpPaths.tmp_concat_list, '+w', encoding='utf-8') as tmp_concat_list:
+    with open(ws.tmp_paths.tmp_concat_list, '+w', encoding='utf-8') as tmp_concat_list:
         tmp_concat_list.writelines(ws.tmp_webm_files)
 
     localization.print(f'concatenating{"_audio" if ws.has_audio else ""}')
     # fmt:off
     concatenate_command = [
         'ffmpeg', '-y', '-f', 'concat',
-        '-safe', '0', '-i', TmpPaths.tmp_concat_list,
+        '-safe', '0', '-i', ws.tmp_paths.tmp_concat_list,
     ]
     # fmt:on
     if ws.has_audio:
-        concatenate_command += ['-i', TmpPaths.tmp_audio]
+        concatenate_command += ['-i', ws.tmp_paths.tmp_audio]
     concatenate_command += ['-c', 'copy', '-auto-alt-ref', '0', output_path]
     ffmpeg_util.exec_command(concatenate_command)
 
-    localization.print('done_removing_temp')
-    TmpPaths.cleanup()
-    print('Wackified:', output_path)
+
+def get_default_output_path(video_path: Path, selected_modes: List[str]) -> Path:
+    return video_path.parent / f'{video_path.stem}_{"_".join(selected_modes)}.webm'
 
 
 if __name__ == '__main__':
@@ -160,22 +719,51 @@ if __name__ == '__main__':
         args_util.print_help()
         sys.exit(1)
     _args.file = _args.file.resolve()
-    _selected_modes = [mode.lower() for mode in _args.modes.split("+")]
-    for selected_mode in _selected_modes:
+    # several mode sets, separated by ";", are rendered side by side from one decode
+    _variants = parse_variants(_args)
+    for selected_mode in [mode for variant in _variants for mode in variant.modes]:
         if selected_mode not in MODES:
             print(f'Mode "{selected_mode}" isn\'t available.')
             sys.exit(1)
+    if len(_variants) > 1 and not _args.plan_only and (_args.resume or _args.work_dir):
+        # the variants share one work folder, which a manifest can't describe
+        localization.print('variants_no_work_dir')
+        sys.exit(1)
+    _selected_modes = _variants[0].modes
 
     if _args.output:
         _args.output = _args.output.resolve()
         _args.output.parent.mkdir(parents=True, exist_ok=True)
+        _output_paths = [
+            _args.output.with_name(f'{_args.output.stem}_{variant.name}{_args.output.suffix}') for variant in _variants
+        ]
     else:
-        _args.output = _args.file.parent / f'{_args.file.stem}_{"_".join(_selected_modes)}.webm'
-
+        _args.output = get_default_output_path(_args.file, _selected_modes)
+        _output_paths = [get_default_output_path(_args.file, [variant.name]) for variant in _variants]
+    share_options(_variants, _args)
+
+    if _args.trace:
+        trace.start()
+    # only profiles the main thread, where all the python side work happens; encoders run in ffmpeg
+    profiler = cProfile.Profile() if _args.profile else None
     try:
-        wackify(_selected_modes, _args.file, _args, _args.output)
+        if profiler:
+            profiler.enable()
+        if _args.plan_only:
+            plan_only(_variants, _args.file, _args, _args.plan or _args.output.with_suffix('.plan.json'))
+        elif len(_variants) > 1:
+            wackify_variants(_variants, _args.file, _args, _output_paths)
+        else:
+            wackify(_selected_modes, _args.file, _variants[0].args, _args.output)
     except Exception as exception:
         print(exception)
         print('-' * 20)
-        print('Something unexpected happened. Cleaning up...')
-        TmpPaths.cleanup()
+        print('Something unexpected happened.')
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(_args.profile)
+            print('Profile written to', _args.profile)
+        if _args.trace:
+            trace.save(_args.trace)
+            print('Trace written to', _args.trace)